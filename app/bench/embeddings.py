@@ -0,0 +1,96 @@
+"""
+Сравнение бэкендов эмбеддингов: torch (эталон) и onnx (int8).
+
+    python -m app.bench.embeddings [n_статей] [batch]
+
+Фиксированный набор — первые n статей базы по id. Каждый бэкенд запускается
+в отдельном процессе (spawn), чтобы пиковый RSS не смешивался.
+Точность — против уже сохранённых torch-векторов (если их нет — против свежего прогона torch):
+косинус по статьям, совпадение ближайшего соседа и согласие решения «в тот же сюжет» (STORY_SIM).
+Код выхода 1 — если int8 заметно расходится с эталоном.
+"""
+import sys, json, time, resource
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+MIN_COS = 0.98       # средний косинус int8 ↔ torch ниже — бэкенд непригоден
+MIN_STORY_AGREE = 0.99
+
+
+def _run(backend, texts, batch):
+    # выполняется в отдельном процессе: замер загрузки, скорости и пикового RSS
+    from app.nlp.embeddings import get_model, embed_texts
+    t0 = time.perf_counter()
+    get_model(backend)
+    load_s = time.perf_counter() - t0
+    embed_texts(texts[:batch], backend)  # прогрев
+    t0 = time.perf_counter()
+    vecs = np.vstack([embed_texts(texts[i:i+batch], backend) for i in range(0, len(texts), batch)])
+    enc_s = time.perf_counter() - t0
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux: КБ
+    return {
+        "load_s": round(load_s, 2),
+        "texts_per_s": round(len(texts) / enc_s, 1),
+        "ms_per_batch": round(1000 * enc_s / max(1, -(-len(texts) // batch)), 1),
+        "peak_rss_mb": round(rss_mb, 1),
+    }, vecs.astype(np.float32)
+
+def _in_process(backend, texts, batch):
+    with ProcessPoolExecutor(1, mp_context=mp.get_context("spawn")) as ex:
+        return ex.submit(_run, backend, texts, batch).result()
+
+def fixed_set(n):
+    from app.storage.db import get_db
+    with get_db() as conn:
+        return conn.execute("SELECT id, title, summary FROM articles ORDER BY id LIMIT ?", (n,)).fetchall()
+
+def accuracy(ref, vecs, story_sim):
+    ref = ref / np.linalg.norm(ref, axis=1, keepdims=True)
+    vecs = vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+    cos = np.sum(ref * vecs, axis=1)
+    s_ref, s_new = ref @ ref.T, vecs @ vecs.T
+    np.fill_diagonal(s_ref, -1); np.fill_diagonal(s_new, -1)
+    iu = np.triu_indices(len(ref), 1)
+    return {
+        "cos_mean": round(float(cos.mean()), 4),
+        "cos_p5": round(float(np.percentile(cos, 5)), 4),
+        "cos_min": round(float(cos.min()), 4),
+        "nn_agree": round(float(np.mean(s_ref.argmax(1) == s_new.argmax(1))), 4),
+        "story_agree": round(float(np.mean((s_ref[iu] >= story_sim) == (s_new[iu] >= story_sim))), 4),
+    }
+
+def main(n=500, batch=64):
+    from app.storage.db import init_db
+    from app.storage.vectors import load_vectors
+    from app.nlp.embeddings import BACKENDS, embed_tag, article_text
+    from app.nlp.stories import STORY_SIM
+    init_db()
+    rows = fixed_set(n)
+    if len(rows) < 2:
+        print(json.dumps({"error": "в базе меньше 2 статей — сначала соберите ленты"}, ensure_ascii=False))
+        return 1
+    ids, texts = [r[0] for r in rows], [article_text(r[1], r[2]) for r in rows]
+    report, out = {"n": len(rows), "batch": batch}, {}
+    for b in BACKENDS:
+        report[b], out[b] = _in_process(b, texts, batch)
+    stored = load_vectors(ids, embed_tag("torch"))
+    if len(stored) == len(ids):
+        ref, report["reference"] = np.vstack([stored[i] for i in ids]), "stored"
+    else:
+        ref, report["reference"] = out["torch"], "torch"
+    report["accuracy"] = {b: accuracy(ref, out[b], STORY_SIM) for b in BACKENDS if b != "torch"}
+    report["speedup"] = {b: round(report[b]["texts_per_s"] / report["torch"]["texts_per_s"], 2)
+                         for b in BACKENDS if b != "torch"}
+    ok = all(a["cos_mean"] >= MIN_COS and a["story_agree"] >= MIN_STORY_AGREE
+             for a in report["accuracy"].values())
+    report["ok"] = ok
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    batch = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    sys.exit(main(n, batch))
@@ -0,0 +1,191 @@
+"""
+Фикстуры для офлайн-бенчмарков: ленты RSS и свечи ISS без сети.
+
+    python -m app.bench.fixtures --record    # один раз записать живые ленты и свечи (нужна сеть)
+
+Записанное лежит в data/bench/fixtures/{rss,iss}; чего нет — генерируется детерминированно
+(seed), поэтому бенчмарк воспроизводим и на машине без записи.
+Replay — обработчик для httpx.MockTransport: отдаёт ленты по URL из SOURCES (с ETag/304,
+как настоящие серверы) и свечи по пути ISS (с постраничной выдачей по start).
+Записанные свечи сдвигаются так, чтобы последний бар был «сейчас», — иначе окно влияния пустое.
+"""
+import os, re, sys, json, zlib, random, hashlib
+import datetime as dt
+from email.utils import formatdate
+from typing import Dict, List, Optional
+from xml.sax.saxutils import escape
+
+import httpx
+
+from app.core.config import SOURCES, Source
+from app.nlp.topics import COMPANY_MAP
+
+FIXTURE_DIR = os.path.join(os.getcwd(), "data", "bench", "fixtures")
+FEED_ITEMS = 20    # свежих статей в каждой синтетической ленте
+CANDLE_DAYS = 31
+ISS_PAGE = 500
+
+_COMPANIES = ["Сбербанк", "ВТБ", "Газпром", "Лукойл", "Роснефть", "Новатэк", "Норникель", "Русал",
+              "Северсталь", "Полюс", "Магнит", "Аэрофлот", "Яндекс", "Мосбиржа", "Интер РАО", "Банк России"]
+_EVENTS = ["отчитался о прибыли за квартал", "объявил дивиденды по акциям", "увеличил выручку",
+           "сообщил о выкупе акций", "нарастил добычу", "разместил облигации", "пересмотрел прогноз",
+           "попал под новые санкции", "сообщил о сделке", "снизил капитальные затраты"]
+_DETAILS = ["выше ожиданий аналитиков", "на фоне ослабления рубля", "вслед за ростом нефти",
+            "после решения по ключевой ставке", "по итогам собрания акционеров", "в первом полугодии",
+            "несмотря на давление на рынок", "с учётом курса доллара"]
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"\W+", "_", name).strip("_").lower()
+
+def _story_text(k: int):
+    co = _COMPANIES[k % len(_COMPANIES)]
+    ev = _EVENTS[(k // len(_COMPANIES)) % len(_EVENTS)]
+    det = _DETAILS[(k // (len(_COMPANIES) * len(_EVENTS))) % len(_DETAILS)]
+    title = f"{co} {ev} {det}"
+    summary = f"{co} {ev}. Акции компании отреагировали на новость {det}; сделка №{k}."
+    return title, summary
+
+def synthetic_articles(n: int, now: int, hours: int = 24, seed: int = 0,
+                       url_prefix: str = "https://bench.local/a") -> List[Dict]:
+    """n статей в окне hours: сюжеты по 1–6 публикаций из разных источников, как отдаёт сборщик."""
+    rng = random.Random(seed)
+    out: List[Dict] = []
+    k = 0
+    while len(out) < n:
+        title, summary = _story_text(k)
+        t0 = now - rng.randint(0, hours * 3600 - 1)
+        for j in range(min(rng.choice([1, 1, 2, 3, 4, 6]), n - len(out))):
+            src = rng.choice(SOURCES)
+            out.append({
+                "source": src.name,
+                "url": f"{url_prefix}/{seed}/{k}/{j}",
+                "title": title if j == 0 else f"{title} — {src.name}",
+                "published_ts": min(now, t0 + rng.randint(0, 3 * 3600)),
+                "lang": src.lang,
+                "summary": summary,
+                "content": "",
+                "cred_weight": src.weight,
+                "source_group": src.group,
+            })
+        k += 1
+    return out
+
+def rss_xml(src: Source, items: List[Dict]) -> bytes:
+    parts = [f"<item><title>{escape(a['title'])}</title><link>{escape(a['url'])}</link>"
+             f"<description>{escape(a['summary'])}</description>"
+             f"<pubDate>{formatdate(a['published_ts'], usegmt=True)}</pubDate></item>" for a in items]
+    return ('<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel>'
+            f"<title>{escape(src.name)}</title>{''.join(parts)}</channel></rss>").encode()
+
+def _fmt(t: dt.datetime) -> str:
+    return t.strftime("%Y-%m-%d %H:%M:%S")
+
+def synthetic_candles(secid: str, now: int, days: int = CANDLE_DAYS) -> List[list]:
+    """Часовые бары [begin, close, volume]: случайное блуждание с seed от тикера."""
+    rng = random.Random(zlib.crc32(secid.encode()))
+    end = dt.datetime.utcfromtimestamp(now).replace(minute=0, second=0, microsecond=0)
+    px, rows = rng.uniform(50, 5000), []
+    for h in range(days * 24, -1, -1):
+        px *= 1 + rng.gauss(0, 0.004)
+        rows.append([_fmt(end - dt.timedelta(hours=h)), round(px, 4), rng.randint(1_000, 200_000)])
+    return rows
+
+def _shift(rows: List[list], now: int) -> List[list]:
+    if not rows:
+        return rows
+    last = dt.datetime.strptime(rows[-1][0], "%Y-%m-%d %H:%M:%S")
+    end = dt.datetime.utcfromtimestamp(now).replace(minute=0, second=0, microsecond=0)
+    d = dt.timedelta(hours=round((end - last).total_seconds() / 3600))
+    return [[_fmt(dt.datetime.strptime(b, "%Y-%m-%d %H:%M:%S") + d), c, v] for b, c, v in rows]
+
+
+_ISS_PATH = re.compile(r"/securities/([^/]+)/candles\.json$")
+
+class Replay:
+    """Обработчик для httpx.MockTransport: ленты и свечи ISS из фикстур."""
+
+    def __init__(self, feeds: Dict[str, bytes], candles: Dict[str, List[list]], now: int):
+        self.feeds = {str(httpx.URL(u)): body for u, body in feeds.items()}
+        self.candles = candles
+        self.now = now
+        self.requests = 0
+
+    @classmethod
+    def load(cls, now: int, root: str = FIXTURE_DIR, seed: int = 1) -> "Replay":
+        feeds, candles = {}, {}
+        for i, src in enumerate(SOURCES):
+            path = os.path.join(root, "rss", _slug(src.name) + ".xml")
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    feeds[src.url] = f.read()
+            else:
+                items = synthetic_articles(FEED_ITEMS, now, 1, seed=seed * 1000 + i,
+                                           url_prefix=f"https://bench.local/{_slug(src.name)}")
+                feeds[src.url] = rss_xml(src, items)
+        iss = os.path.join(root, "iss")
+        for name in (os.listdir(iss) if os.path.isdir(iss) else []):
+            with open(os.path.join(iss, name)) as f:
+                candles[name[:-5]] = _shift(json.load(f)["candles"]["data"], now)
+        return cls(feeds, candles, now)
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        body = self.feeds.get(str(request.url))
+        if body is not None:
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+            if request.headers.get("If-None-Match") == etag:
+                return httpx.Response(304, headers={"ETag": etag})
+            return httpx.Response(200, content=body, headers={"ETag": etag, "Content-Type": "application/rss+xml"})
+        m = _ISS_PATH.search(request.url.path)
+        if request.url.host == "iss.moex.com" and m:
+            secid = m.group(1)
+            if secid not in self.candles:
+                self.candles[secid] = synthetic_candles(secid, self.now)
+            frm = request.url.params.get("from", "")
+            start = int(request.url.params.get("start", 0))
+            rows = [r for r in self.candles[secid] if r[0] >= frm][start:start + ISS_PAGE]
+            return httpx.Response(200, json={"candles": {"columns": ["begin", "close", "volume"], "data": rows}})
+        return httpx.Response(404)
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self)
+
+
+def record(root: str = FIXTURE_DIR, secids: Optional[List[str]] = None):
+    """Записать живые ленты SOURCES и 30д часовых свечей по тикерам словаря (нужна сеть)."""
+    from app.core.impact import FX_ALIASES, _detect_engine_market, _iss_candles, _start30
+    import time
+    os.makedirs(os.path.join(root, "rss"), exist_ok=True)
+    os.makedirs(os.path.join(root, "iss"), exist_ok=True)
+    done = {"rss": [], "iss": []}
+    with httpx.Client(timeout=20.0, headers={"User-Agent": "RADAR/1.0"}, follow_redirects=True) as c:
+        for src in SOURCES:
+            try:
+                r = c.get(src.url)
+                r.raise_for_status()
+            except httpx.HTTPError as e:
+                print(f"skip {src.name}: {e}", file=sys.stderr)
+                continue
+            with open(os.path.join(root, "rss", _slug(src.name) + ".xml"), "wb") as f:
+                f.write(r.content)
+            done["rss"].append(src.name)
+    secids = secids or sorted({s for v in COMPANY_MAP.values() for s in v} | set(FX_ALIASES))
+    start30 = _start30(int(time.time()))
+    for secid in secids:
+        (engine, market), real = _detect_engine_market(secid)
+        bars = _iss_candles(engine, market, real, start30)
+        if not bars:
+            print(f"skip {secid}: ISS недоступен", file=sys.stderr)
+            continue
+        with open(os.path.join(root, "iss", real + ".json"), "w") as f:
+            json.dump({"candles": {"columns": ["begin", "close", "volume"], "data": bars}}, f)
+        done["iss"].append(real)
+    return done
+
+
+if __name__ == "__main__":
+    if "--record" in sys.argv[1:]:
+        print(json.dumps(record(), ensure_ascii=False, indent=2))
+    else:
+        print(__doc__)
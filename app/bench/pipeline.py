@@ -0,0 +1,123 @@
+"""
+Бенчмарк пайплайна целиком, без сети: ленты и ISS отдаёт Replay (app.bench.fixtures).
+
+    python -m app.bench.pipeline [n ...] [--hours=24] [--save-baseline | --check]
+
+Каждый масштаб n (по умолчанию 1k/10k/100k статей в окне) — отдельный процесс (spawn)
+со своей БД и ANN-индексом в data/bench/<n>, поэтому пиковый RSS не смешивается. Фазы:
+  ingest — то, что в проде делает ingestor: upsert, векторы, ANN, сюжеты, признаки и свечи;
+  cold   — build_events(fetch=True): ленты из фикстур + «хвост» + карточки;
+  warm   — повторный build_events(fetch=False) на тех же данных.
+Время стадий — спаны app.core.profiler, плюс пропускная способность и peak RSS.
+
+--save-baseline пишет результат в data/bench/baseline.json (цифры зависят от машины — база локальная),
+--check сравнивает с ней: стадия медленнее базы на SLOWER и минимум на MIN_DELTA_S — код выхода 1.
+"""
+import os, sys, json, time, shutil, resource
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+BENCH_DIR = os.path.join(os.getcwd(), "data", "bench")
+BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+SCALES = (1_000, 10_000, 100_000)
+SLOWER = 0.25       # +25% к базе — регрессия…
+MIN_DELTA_S = 0.05  # …если это больше 50 мс (шум на быстрых стадиях не считаем)
+
+
+def _rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)  # Linux: КБ
+
+def _run(n, hours, top_k):
+    # выполняется в отдельном процессе: своя БД, свой индекс, сеть — через фикстуры
+    root = os.path.join(BENCH_DIR, str(n))
+    shutil.rmtree(root, ignore_errors=True)
+    from app.storage import db
+    from app.nlp import ann
+    db.DB_PATH = os.path.join(root, "radar.db")
+    db.ARCHIVE_PATH = os.path.join(root, "radar_archive.db")
+    ann.ANN_DIR = os.path.join(root, "ann")
+    from app.fetchers import rss_html
+    from app.core import impact
+    from app.core.profiler import trace, span
+    from app.core.pipeline import build_events
+    from app.storage.ingest import upsert_articles
+    from app.nlp.embeddings import embed_pending
+    from app.nlp.stories import assign_pending
+    from app.scoring.materialized import refresh_stories
+    from app.bench.fixtures import Replay, synthetic_articles
+
+    now = int(time.time())
+    replay = Replay.load(now)
+    rss_html.use_transport(replay.transport())
+    impact.use_transport(replay.transport())
+    db.init_db()
+    items = synthetic_articles(n, now, hours)
+    report = {"n": n, "hours": hours}
+
+    with trace() as tr:
+        with span("ingest.upsert"):
+            upsert_articles(items)
+        with span("ingest.embed"):
+            embed_pending()
+        with span("ingest.ann"):
+            ann.sync_index()
+        with span("ingest.assign"):
+            assign_pending()
+        with span("ingest.refresh"):
+            refresh_stories(now)
+    report["ingest"] = tr.as_dict()
+    report["ingest"]["articles_per_s"] = round(n / report["ingest"]["total_s"], 1)
+    report["ingest"]["peak_rss_mb"] = _rss_mb()
+
+    for phase, fetch in (("cold", True), ("warm", False)):
+        requests0 = replay.requests
+        with trace() as tr:
+            evs = build_events(hours, top_k, fetch=fetch)
+        report[phase] = tr.as_dict()
+        report[phase].update(events=len(evs), http_requests=replay.requests - requests0, peak_rss_mb=_rss_mb())
+    return report
+
+def _in_process(n, hours, top_k):
+    with ProcessPoolExecutor(1, mp_context=mp.get_context("spawn")) as ex:
+        return ex.submit(_run, n, hours, top_k).result()
+
+def _flat(report):
+    """{"<n>/<фаза>/<стадия>": секунды} — то, что сравнивается с базой."""
+    out = {}
+    for r in report["scales"]:
+        for phase in ("ingest", "cold", "warm"):
+            out[f"{r['n']}/{phase}/total"] = r[phase]["total_s"]
+            for stage, v in r[phase]["stages"].items():
+                out[f"{r['n']}/{phase}/{stage}"] = v["s"]
+    return out
+
+def regressions(report, baseline):
+    cur, base = _flat(report), _flat(baseline)
+    return [{"stage": k, "baseline_s": base[k], "now_s": v, "ratio": round(v / base[k], 2)}
+            for k, v in sorted(cur.items())
+            if k in base and v > base[k] * (1 + SLOWER) and v - base[k] > MIN_DELTA_S]
+
+def main(scales=SCALES, hours=24, top_k=8, save=False, check=False):
+    report = {"scales": [_in_process(n, hours, top_k) for n in scales]}
+    rc = 0
+    if check:
+        if not os.path.exists(BASELINE):
+            report["error"] = f"нет базы {BASELINE} — сначала --save-baseline"
+            rc = 2
+        else:
+            with open(BASELINE) as f:
+                report["regressions"] = regressions(report, json.load(f))
+            rc = 1 if report["regressions"] else 0
+    if save:
+        os.makedirs(BENCH_DIR, exist_ok=True)
+        with open(BASELINE, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return rc
+
+
+if __name__ == "__main__":
+    flags = [a for a in sys.argv[1:] if a.startswith("--")]
+    scales = [int(a) for a in sys.argv[1:] if not a.startswith("--")] or SCALES
+    hours = next((int(a.split("=", 1)[1]) for a in flags if a.startswith("--hours=")), 24)
+    sys.exit(main(scales, hours, save="--save-baseline" in flags, check="--check" in flags))
@@ -0,0 +1,85 @@
+"""
+Время старта: импорт модулей по отдельности и (опционально) загрузка модели.
+
+    python -m app.bench.startup [--model] [top_n]
+
+Каждый модуль импортируется в чистом процессе с `python -X importtime`,
+поэтому цифры не зависят от порядка и кэша уже загруженных пакетов.
+cumulative_ms — сколько стоит `import <модуль>` целиком, heaviest — самые дорогие
+пакеты верхнего уровня в его дереве импорта (то, что стоит откладывать).
+"""
+import os, re, sys, json, subprocess
+
+MODULES = [
+    "app.core.config", "app.storage.db", "app.nlp.matcher", "app.nlp.embeddings",
+    "app.fetchers.rss_html", "app.core.impact", "app.core.pipeline", "app.core.ingestor",
+    "app.bot.main",
+    # сторонние тяжеловесы — для сравнения, что именно отложено
+    "aiogram", "httpx", "feedparser", "trafilatura", "sentence_transformers", "sklearn",
+]
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_times(module):
+    """[(пакет, вложенность, self_us, cumulative_us)] из -X importtime для `import module` (или `pass`)."""
+    env = dict(os.environ)
+    env.setdefault("TG_BOT_TOKEN", "123456:bench")  # app.bot.main требует токен при импорте (в сеть не ходит)
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}" if module else "pass"],
+                       capture_output=True, text=True, env=env)
+    if p.returncode != 0:
+        raise RuntimeError(p.stderr.strip().splitlines()[-1] if p.stderr.strip() else f"exit {p.returncode}")
+    out = []
+    for line in p.stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            out.append((m.group(4), len(m.group(3)) // 2, int(m.group(1)), int(m.group(2))))
+    return out
+
+_base = None
+def _interpreter_modules():
+    # site, encodings и т.п. грузятся при старте интерпретатора — к модулю не относятся
+    global _base
+    if _base is None:
+        _base = {name for name, *_ in import_times(None)}
+    return _base
+
+def module_report(module, top_n):
+    try:
+        base = _interpreter_modules()
+        rows = [r for r in import_times(module) if r[0] not in base]
+    except Exception as e:
+        return {"error": str(e)}
+    total = next((c for name, _, _, c in rows if name == module), sum(s for _, _, s, _ in rows))
+    # «верхний уровень» — корневые пакеты, импортированные ради модуля (torch, sklearn, ...)
+    roots = {}
+    for name, _, _, cum in rows:
+        if "." not in name and name != module.split(".")[0]:
+            roots[name] = max(roots.get(name, 0), cum)
+    heavy = sorted(roots.items(), key=lambda kv: -kv[1])[:top_n]
+    return {
+        "cumulative_ms": round(total / 1000, 1),
+        "modules": len(rows),
+        "heaviest": [{"package": n, "ms": round(c / 1000, 1)} for n, c in heavy],
+    }
+
+def model_report():
+    # загрузка + первый encode в отдельном процессе: то, что бот делает в фоне (warm())
+    code = ("import time; t=time.perf_counter(); import app.nlp.embeddings as e; i=time.perf_counter()-t;"
+            "w=e.warm_up(); print(i, w)")
+    p = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if p.returncode != 0:
+        return {"error": p.stderr.strip().splitlines()[-1] if p.stderr.strip() else f"exit {p.returncode}"}
+    imp, warm = map(float, p.stdout.split()[-2:])
+    return {"import_s": round(imp, 2), "load_and_first_encode_s": round(warm, 2)}
+
+def main(with_model=False, top_n=5):
+    report = {m: module_report(m, top_n) for m in MODULES}
+    if with_model:
+        report["model"] = model_report()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if a != "--model"]
+    main("--model" in sys.argv[1:], int(args[0]) if args else 5)
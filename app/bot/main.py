@@ -1,14 +1,27 @@
 import os, time, asyncio, logging, html
 from urllib.parse import urlparse
 from aiogram import Bot, Dispatcher, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
 from aiogram.types import (Message, ReplyKeyboardMarkup, KeyboardButton,
                            InlineKeyboardMarkup, InlineKeyboardButton)
 from dotenv import load_dotenv, find_dotenv
 
 from app.storage.db import init_db
-from app.core.pipeline import build_events
+from app.core.config import (INGEST_IN_BOT, RESULT_TTL_S, WARMUP_MODEL, ALERT_EVERY_S,
+                             ALERT_HOT_DEFAULT, ALERT_TICKER_DEFAULT, METRICS_PORT, PROFILE_ADMINS)
+from app.core.cache import ResultCache
+from app.storage.ingest import articles_version
+from app.core.ingestor import Ingestor
+from app.core.workers import run_io, run_cpu, aiter_io, shutdown as shutdown_workers
+from app.core.pipeline import build_events, stream_events
+from app.nlp.embeddings import model_ready, warm_up
+from app.nlp.stories import similar_stories
+from app.nlp.matcher import resolve_secid
+from app.core.alerts import due_alerts
+from app.storage.subscriptions import subscribe, unsubscribe, user_subscriptions, mark_sent
 from app.core.postplay import channel_draft, trader_actions
+from app.core.profiler import trace, profile_call, metrics_text
 
 load_dotenv(find_dotenv())
 logging.basicConfig(level=logging.INFO)
@@ -19,14 +32,23 @@ if not TOKEN: raise RuntimeError("Нет TG_BOT_TOKEN в .env")
 bot=Bot(token=TOKEN)
 dp=Dispatcher()
 user_semaphores = {}
+user_jobs = {}    # uid -> asyncio.Future текущего build_events (повторное нажатие отменяет)
+results = ResultCache(RESULT_TTL_S)  # общий для всех пользователей: (hours, k) -> события
 user_params = {}  # uid -> {hours,k,last_cmd}
+background = set()  # asyncio держит на задачи только слабые ссылки — без этого их может съесть GC
+
+def spawn(coro):
+    t=asyncio.create_task(coro)
+    background.add(t)
+    t.add_done_callback(background.discard)
+    return t
 
 def kb_main():
     return ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="🔥 Горячее (24ч)"), KeyboardButton(text="📰 Черновики 24ч")],
             [KeyboardButton(text="📈 Трейд"), KeyboardButton(text="⚙️ Окно/TopK")],
-            [KeyboardButton(text="🔁 Обновить"), KeyboardButton(text="❓ Помощь")]
+            [KeyboardButton(text="🔁 Обновить"), KeyboardButton(text="🔔 Подписки"), KeyboardButton(text="❓ Помощь")]
         ],
         resize_keyboard=True
     )
@@ -36,12 +58,89 @@ def get_params(uid):
     user_params[uid]=p
     return p
 
+def embed_ready():
+    # без прогрева — как раньше: модель грузится первым запросом
+    return model_ready() or not WARMUP_MODEL
+
+async def _build(hours,k,embed):
+    # пайплайн — в пуле потоков: event loop бота продолжает обслуживать остальных
+    return await run_io(build_events, hours, k, fetch=False, embed=embed)
+
 async def safe_build(hours,k):
-    try: return build_events(hours, max(k,5))
+    k=max(k,5)
+    try:
+        # одинаковые (окно, topK) от разных пользователей — один прогон; новые статьи сбрасывают кэш
+        ver=await run_io(articles_version)
+        embed=embed_ready()  # ответ «только по БД» кэшируется отдельно и не переживает прогрев
+        return await results.get((hours,k,embed), ver, lambda: _build(hours,k,embed))
+    except asyncio.CancelledError: raise
     except Exception as e:
         logging.exception("Pipeline error: %s", e)
         return []
 
+async def _stream(hours,k,embed,fut,q):
+    # общий прогон: отмена у пользователя его не рвёт, итог уходит в кэш через fut
+    try:
+        async for evs, final in aiter_io(stream_events(hours, k, fetch=False, embed=embed)):
+            q.put_nowait((evs, final))
+        fut.set_result(evs)
+    except Exception as e:
+        logging.exception("Pipeline error: %s", e)
+        fut.set_exception(e)
+        q.put_nowait(None)
+
+async def start_stream(hours,k):
+    """Очередь снимков (события, final) нового прогона; None — результат уже в кэше или его считают."""
+    k=max(k,5)
+    ver=await run_io(articles_version)
+    embed=embed_ready()
+    fut=results.claim((hours,k,embed), ver)
+    if fut is None:
+        return None
+    q=asyncio.Queue()
+    spawn(_stream(hours,k,embed,fut,q))
+    return q
+
+async def show_stream(m, wait, q):
+    """Карточки по мере готовности: первый снимок — сразу, уточнённые метрики — правкой тех же сообщений."""
+    msgs=[]; shown=[]
+    while True:
+        item=await q.get()
+        if item is None:
+            break
+        evs, final = item
+        cards=[(card_html(ev, f"TOP {i}"), links_kb(ev)) for i,ev in enumerate(evs,1)]
+        if not cards and not final:
+            continue
+        for i,(text,kb) in enumerate(cards):
+            if i < len(msgs):
+                if shown[i] != text:
+                    try:
+                        await msgs[i].edit_text(text, parse_mode="HTML", reply_markup=kb)
+                        shown[i]=text
+                    except TelegramBadRequest as e:
+                        logging.warning("card edit failed: %s", e)
+            else:
+                msgs.append(await m.answer(text, parse_mode="HTML", reply_markup=kb)); shown.append(text)
+        for extra in msgs[len(cards):]:
+            await extra.delete()
+        del msgs[len(cards):], shown[len(cards):]
+        if final:
+            break
+        await wait.edit_text("Досчитываю рыночные метрики (Δ/vol/σ)…")
+    await wait.delete()
+    if not msgs:
+        await m.answer("В окне пусто или всё шум.")
+
+def card_html(ev, title):
+    pct_str, vr_str, pa_str = fmt_imp(ev.get("impact", {}))
+    return (f"<b>{title} — {html.escape(ev['headline'])}</b>\n"
+            f"hotness: <b>{ev['hotness']:.3f}</b> · валидн.: <b>{ev.get('validity',0):.2f}</b>\n"
+            f"Δ {pct_str} · vol {vr_str} · σ {pa_str}\n"
+            f"<i>Почему сейчас:</i> {html.escape(ev['why_now'])}\n"
+            f"<i>Время:</i> {fmt_tspan(ev)}\n"
+            f"<i>Тикеры:</i> {html.escape(', '.join(ev['secids'] or ['—']))}")
+
 def links_kb(ev):
     # Дедуп по доменам, чтобы не было «Interfax/Интерфакс» дважды
     seen=set(); buttons=[]
@@ -90,17 +189,37 @@ async def help_msg(m:Message):
         "• 📰 Черновики 24ч — строки для канала (цитата и действия).\n"
         "• 📈 Трейд — чёткие действия трейдера.\n"
         "• ⚙️ Окно/TopK — пресеты.\n"
-        "• 🔁 Обновить — повтор последней команды.",
+        "• 🔁 Обновить — повтор последней команды.\n"
+        "• /similar <текст> — похожие события из прошлого (вся история, включая архив).\n"
+        "• 🔔 Подписки — алерты без нажатий: /sub SBER, /sub Газпром 0.6, /sub hot 0.75, /unsub SBER, /unsub all.",
         reply_markup=kb_main()
     )
 
 async def handle(m:Message, mode:str):
     uid=m.from_user.id
+    prev=user_jobs.get(uid)
+    if prev and not prev.done():
+        prev.cancel()  # пользователь нажал снова — старый результат уже не нужен
     sem=user_semaphores.setdefault(uid, asyncio.Semaphore(1))
     async with sem:
         p=get_params(uid); hours=p["hours"]; k=max(p["k"],5); p["last_cmd"]=mode
-        wait=await m.answer("Ищу события…")
-        evs=await safe_build(hours,k)
+        wait=await m.answer("Ищу события…" if embed_ready() else "Ищу события… (модель прогревается — ответ по сохранённым сюжетам)")
+        # «Горячее» без готового результата — потоком: карточки до ответа ISS, метрики — правкой
+        q=await start_stream(hours,k) if mode=="hot" else None
+        job=asyncio.ensure_future(show_stream(m, wait, q) if q else safe_build(hours,k))
+        user_jobs[uid]=job
+        try:
+            evs=await job
+        except asyncio.CancelledError:
+            try:
+                await wait.delete()
+            except TelegramBadRequest:
+                pass  # show_stream уже убрал заглушку
+            return
+        finally:
+            if user_jobs.get(uid) is job: user_jobs.pop(uid, None)
+        if q:
+            return
         await wait.delete()
         if not evs:
             await m.answer("В окне пусто или всё шум.")
@@ -108,14 +227,7 @@ async def handle(m:Message, mode:str):
 
         if mode=="hot":
             for i,ev in enumerate(evs,1):
-                pct_str, vr_str, pa_str = fmt_imp(ev.get("impact", {}))
-                head=(f"<b>TOP {i} — {html.escape(ev['headline'])}</b>\n"
-                      f"hotness: <b>{ev['hotness']:.3f}</b> · валидн.: <b>{ev.get('validity',0):.2f}</b>\n"
-                      f"Δ {pct_str} · vol {vr_str} · σ {pa_str}\n"
-                      f"<i>Почему сейчас:</i> {html.escape(ev['why_now'])}\n"
-                      f"<i>Время:</i> {fmt_tspan(ev)}\n"
-                      f"<i>Тикеры:</i> {html.escape(', '.join(ev['secids'] or ['—']))}")
-                await m.answer(head, parse_mode="HTML", reply_markup=links_kb(ev))
+                await m.answer(card_html(ev, f"TOP {i}"), parse_mode="HTML", reply_markup=links_kb(ev))
         elif mode=="drafts":
             lines=[f"{i}. {html.escape(channel_draft(ev))}" for i,ev in enumerate(evs,1)]
             for part in split_msg("\n\n".join(lines)):
@@ -155,6 +267,140 @@ async def refresh(m:Message):
     p=get_params(m.from_user.id)
     await handle(m, p["last_cmd"])
 
+@dp.message(Command("similar"))
+async def similar(m:Message, command:CommandObject):
+    q=(command.args or "").strip()
+    if not q:
+        await m.answer("Напишите: /similar ЦБ повысил ключевую ставку")
+        return
+    if not embed_ready():
+        await m.answer("Модель ещё прогревается — попробуйте через минуту.")
+        return
+    try:
+        hits=await run_io(similar_stories, q, 5)
+    except Exception as e:
+        logging.exception("similar error: %s", e)
+        hits=[]
+    if not hits:
+        await m.answer("Похожих событий не нашлось.")
+        return
+    lines=[]
+    for i,h in enumerate(hits,1):
+        when=time.strftime('%d.%m.%Y', time.localtime(h['published_ts'] or 0))
+        lines.append(f"{i}. <a href=\"{html.escape(h['url'] or '', quote=True)}\">{html.escape((h['title'] or '—')[:160])}</a>\n"
+                     f"   {when} · {html.escape(h['source'] or '')} · сходство {h['sim']:.2f} · статей в сюжете: {h['n']}")
+    await m.answer("\n".join(lines), parse_mode="HTML", disable_web_page_preview=True)
+
+def _parse_threshold(arg, default):
+    try:
+        return min(1.0, max(0.0, float(arg.replace(",", "."))))
+    except (AttributeError, ValueError):
+        return default
+
+@dp.message(Command("sub"))
+async def sub(m:Message, command:CommandObject):
+    args=(command.args or "").split()
+    if not args:
+        await m.answer("Напишите: /sub SBER · /sub Газпром 0.6 · /sub hot 0.75")
+        return
+    has_thr = len(args) > 1 and _parse_threshold(args[-1], None) is not None
+    what = " ".join(args[:-1] if has_thr else args)
+    if what.lower() in ("hot", "горячее"):
+        thr=_parse_threshold(args[-1] if has_thr else None, ALERT_HOT_DEFAULT)
+        await run_io(subscribe, m.from_user.id, "hot", "*", thr)
+        await m.answer(f"Готово: пришлю любой сюжет с hotness ≥ {thr:.2f}.")
+        return
+    sec=resolve_secid(what)
+    if not sec:
+        await m.answer("Не знаю такой бумаги. Примеры: SBER, GAZP, «Лукойл».")
+        return
+    thr=_parse_threshold(args[-1] if has_thr else None, ALERT_TICKER_DEFAULT)
+    await run_io(subscribe, m.from_user.id, "ticker", sec, thr)
+    await m.answer(f"Готово: пришлю сюжеты по {sec} с hotness ≥ {thr:.2f}.")
+
+@dp.message(Command("unsub"))
+async def unsub(m:Message, command:CommandObject):
+    what=(command.args or "").strip()
+    if not what or what.lower()=="all":
+        n=await run_io(unsubscribe, m.from_user.id)
+    elif what.lower() in ("hot", "горячее"):
+        n=await run_io(unsubscribe, m.from_user.id, "hot", "*")
+    else:
+        n=await run_io(unsubscribe, m.from_user.id, "ticker", resolve_secid(what) or what.upper())
+    await m.answer("Подписка удалена." if n else "Такой подписки нет.")
+
+@dp.message(Command("subs"))
+@dp.message(F.text == "🔔 Подписки")
+async def subs(m:Message):
+    rows=await run_io(user_subscriptions, m.from_user.id)
+    if not rows:
+        await m.answer("Подписок нет. /sub SBER — сюжеты по бумаге, /sub hot 0.75 — всё горячее.")
+        return
+    lines=[f"• {'любой сюжет' if kind=='hot' else value}: hotness ≥ {thr:.2f}" for kind,value,thr in rows]
+    await m.answer("Ваши подписки:\n" + "\n".join(lines) + "\n\n/unsub <тикер|hot|all> — отписаться.")
+
+async def alert_loop(updated=None):
+    # сюжеты пересчитывает ingestor; здесь — только сверка с подписками и отправка
+    while True:
+        if updated is not None:
+            try:
+                await asyncio.wait_for(updated.wait(), ALERT_EVERY_S)
+            except asyncio.TimeoutError:
+                pass
+            updated.clear()
+        else:
+            await asyncio.sleep(ALERT_EVERY_S)
+        try:
+            alerts=await run_io(due_alerts)
+        except Exception:
+            logging.exception("alerts check failed")
+            continue
+        for uid, ev, reason in alerts:
+            try:
+                await bot.send_message(uid, card_html(ev, f"🔔 {html.escape(reason)}"),
+                                       parse_mode="HTML", reply_markup=links_kb(ev))
+                await run_io(mark_sent, uid, ev["dedup_group"], ev["hotness"])
+            except TelegramForbiddenError:
+                await run_io(unsubscribe, uid)  # бот заблокирован — подписки больше не нужны
+            except Exception:
+                logging.exception("alert to %s failed", uid)
+            await asyncio.sleep(0.05)  # не упираться в лимиты Telegram на рассылку
+
+def _profiled_build(hours, k, mode):
+    with trace() as tr:
+        evs, dump = profile_call(build_events, hours, k, fetch=False, embed=embed_ready(), mode=mode)
+    return len(evs), tr.as_dict(), dump
+
+@dp.message(Command("profile"))
+async def profile(m:Message, command:CommandObject):
+    # один прогон мимо кэша под профайлером: спаны стадий в ответ, дамп — в data/profiles
+    if m.from_user.id not in PROFILE_ADMINS:
+        return
+    mode=(command.args or "cprofile").strip()
+    p=get_params(m.from_user.id)
+    try:
+        n, prof, dump = await run_io(_profiled_build, p["hours"], max(p["k"],5), mode)
+    except Exception as e:
+        await m.answer(f"Профилирование не удалось: {html.escape(str(e))}")
+        return
+    stages=sorted(prof["stages"].items(), key=lambda kv: -kv[1]["s"])
+    lines=[f"{html.escape(name)}: {v['s']*1000:.0f} мс ×{v['calls']}" for name,v in stages]
+    lines+=[f"{html.escape(name)} = {v:g}" for name,v in sorted(prof["counters"].items())]
+    await m.answer(f"<b>{p['hours']}ч / Top{p['k']}: {n} событий за {prof['total_s']:.2f} с</b>\n"
+                   + "\n".join(lines) + f"\n\nДамп: <code>{html.escape(dump)}</code>", parse_mode="HTML")
+
+async def serve_metrics(port):
+    # aiohttp уже есть — это зависимость aiogram
+    from aiohttp import web
+    async def metrics(_):
+        return web.Response(text=metrics_text(), content_type="text/plain", charset="utf-8")
+    app=web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner=web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, port=port).start()
+    return runner
+
 @dp.message(F.text == "⚙️ Окно/TopK")
 async def set_params(m:Message):
     kb=InlineKeyboardMarkup(inline_keyboard=[
@@ -172,9 +418,33 @@ async def cb_set(cq):
     await cq.message.edit_text(f"Параметры сохранены: {h}ч / Top{k}.")
     await cq.answer("Ок")
 
+async def warm():
+    # модель — в фоне: бот уже принимает сообщения, ранние запросы получают ответ по БД
+    try:
+        await run_io(warm_up)
+        if INGEST_IN_BOT:
+            await run_cpu(warm_up)  # у процесса-индексатора своя копия модели
+    except Exception:
+        logging.exception("model warmup failed")
+
 async def main():
     init_db()
-    await dp.start_polling(bot)
+    if WARMUP_MODEL:
+        spawn(warm())
+    ingestor=Ingestor() if INGEST_IN_BOT else None
+    if ingestor:
+        spawn(ingestor.run_async())
+    spawn(alert_loop(ingestor.updated if ingestor else None))
+    metrics=await serve_metrics(METRICS_PORT) if METRICS_PORT else None
+    try:
+        await dp.start_polling(bot)
+    finally:
+        for t in list(background):
+            t.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        if metrics:
+            await metrics.cleanup()
+        shutdown_workers()
 
 if __name__=="__main__":
     import asyncio
@@ -0,0 +1,13 @@
+import asyncio, contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+def run_sync(coro):
+    """Выполнить корутину из синхронного кода (run_once, streamlit, поток бота)."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # уже внутри event loop — крутим корутину в отдельном потоке со своим loop
+    # (с копией контекста: замеры app.core.profiler попадают в текущий прогон)
+    with ThreadPoolExecutor(1) as ex:
+        return ex.submit(contextvars.copy_context().run, asyncio.run, coro).result()
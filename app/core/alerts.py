@@ -0,0 +1,60 @@
+"""
+Push-алерты по подпискам бота.
+
+Подписка — на тикер (SECID из KNOWN_TICKERS/COMPANY_MAP) или на любой сюжет выше порога hotness.
+Читаются только материализованные сюжеты (app.scoring.materialized) — пайплайн не запускается.
+Каждый сюжет (dedup_group) уходит пользователю один раз; больше ALERT_MAX_PER_HOUR в час — не шлём,
+сюжет дождётся следующей проверки, если останется горячим.
+"""
+import json, time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import ALERT_WINDOW_H, ALERT_SCAN, ALERT_MAX_PER_HOUR
+from app.core.pipeline import story_events
+from app.scoring.materialized import top_stories
+from app.storage.subscriptions import all_subscriptions, sent_groups, sent_counts
+
+
+def due_alerts(now: Optional[int] = None) -> List[Tuple[int, Dict, str]]:
+    """[(user_id, карточка, причина)] — что пора отправить. Отметку об отправке ставит вызывающий (mark_sent)."""
+    subs = all_subscriptions()
+    if not subs:
+        return []
+    now = now or int(time.time())
+    since = now - ALERT_WINDOW_H*3600
+    low = min(s[3] for s in subs)
+    top = [t for t in top_stories(since, now, ALERT_SCAN) if t[1] is not None and t[1] >= low]
+    if not top:
+        return []
+
+    hits = []  # (hotness, user_id, строка сюжета, причина)
+    for t in top:
+        secids = json.loads(t[6] or "[]")
+        for uid, kind, value, thr in subs:
+            if t[1] < thr:
+                continue
+            if kind == "hot":
+                hits.append((t[1], uid, t, f"hotness ≥ {thr:.2f}"))
+            elif kind == "ticker" and value in secids:
+                hits.append((t[1], uid, t, value))
+    if not hits:
+        return []
+
+    sent = sent_groups((h[1] for h in hits), (f"s{h[2][0]}" for h in hits))
+    hits = [h for h in hits if (h[1], f"s{h[2][0]}") not in sent]
+    rows = list({h[2][0]: h[2] for h in hits}.values())
+    events = {e["dedup_group"]: e for e in story_events(rows, since, now)}
+
+    counts = sent_counts(now - 3600)
+    out, seen = [], set()
+    per_user = defaultdict(int)
+    for hot, uid, t, reason in sorted(hits, key=lambda h: -h[0]):
+        g = f"s{t[0]}"
+        if (uid, g) in seen or g not in events:
+            continue
+        if counts.get(uid, 0) + per_user[uid] >= ALERT_MAX_PER_HOUR:
+            continue
+        seen.add((uid, g)); per_user[uid] += 1
+        out.append((uid, events[g], reason))
+    return out
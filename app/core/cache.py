@@ -0,0 +1,54 @@
+import time, asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from app.core.profiler import count
+
+class ResultCache:
+    """
+    Single-flight + короткий TTL для одинаковых запросов.
+
+    Параллельные get() с одним ключом ждут одно вычисление; готовый результат
+    живёт ttl_s секунд и сбрасывается, как только меняется version
+    (например, ingestion сохранил новые статьи). Ошибки не кэшируются.
+    """
+
+    def __init__(self, ttl_s: float):
+        self.ttl_s = ttl_s
+        self._done: Dict[Hashable, Tuple[float, Any, Any]] = {}   # key -> (stored_at, version, value)
+        self._inflight: Dict[Tuple[Hashable, Any], asyncio.Future] = {}
+
+    async def get(self, key: Hashable, version: Any, compute: Callable[[], Awaitable[Any]]):
+        hit = self._done.get(key)
+        if hit and hit[1] == version and time.monotonic() - hit[0] < self.ttl_s:
+            count("cache.hit")
+            return hit[2]
+        fut = self._inflight.get((key, version))
+        count("cache.shared" if fut is not None else "cache.miss")
+        if fut is None:
+            fut = self._track(key, version, asyncio.ensure_future(compute()))
+        # shield: отмена у одного пользователя не рвёт общий прогон для остальных
+        return await asyncio.shield(fut)
+
+    def claim(self, key: Hashable, version: Any) -> Optional[asyncio.Future]:
+        """
+        Для потоковых прогонов: регистрирует пустой future как вычисление ключа — параллельные get()
+        ждут его, а вызывающий сам кладёт в него итог. None — результат уже есть или кто-то считает.
+        """
+        hit = self._done.get(key)
+        if (hit and hit[1] == version and time.monotonic() - hit[0] < self.ttl_s) or (key, version) in self._inflight:
+            return None
+        count("cache.miss")
+        return self._track(key, version, asyncio.get_running_loop().create_future())
+
+    def _track(self, key, version, fut):
+        self._inflight[(key, version)] = fut
+
+        def _store(f):
+            self._inflight.pop((key, version), None)
+            if not f.cancelled() and f.exception() is None:
+                self._done[key] = (time.monotonic(), version, f.result())
+        fut.add_done_callback(_store)
+        return fut
+
+    def clear(self):
+        self._done.clear()
@@ -1,3 +1,4 @@
+import os
 from dataclasses import dataclass
 
 # ---- Источники (группы: REG – регуляторы, EXCH – биржа, TIER1 – топ-СМИ) ----
@@ -9,13 +10,14 @@ class Source:
     group: str = "TIER1"
     lang: str = "ru"
     weight: float = 0.8  # доверие источнику (0..1), идёт в cred_weight
+    poll_s: int = 300    # период опроса фоновым сборщиком, сек
 
 # Под MOEX и российский рынок
 SOURCES = [
     # Регулятор/биржа
-    Source(name="CBR Press",   url="https://www.cbr.ru/rss/RssPress",   group="REG",  weight=1.00),
-    Source(name="CBR Events",  url="https://www.cbr.ru/rss/eventrss",   group="REG",  weight=1.00),
-    Source(name="MOEX News",   url="https://www.moex.com/export/news.aspx?cat=100", group="EXCH", weight=0.90),
+    Source(name="CBR Press",   url="https://www.cbr.ru/rss/RssPress",   group="REG",  weight=1.00, poll_s=120),
+    Source(name="CBR Events",  url="https://www.cbr.ru/rss/eventrss",   group="REG",  weight=1.00, poll_s=120),
+    Source(name="MOEX News",   url="https://www.moex.com/export/news.aspx?cat=100", group="EXCH", weight=0.90, poll_s=120),
     # Топ-СМИ
     Source(name="Interfax",    url="https://www.interfax.ru/rss.asp",   group="TIER1", weight=0.85),
     Source(name="RBC Finance", url="https://rssexport.rbc.ru/rbcnews/finance/20/full.rss", group="TIER1", weight=0.82),
@@ -25,6 +27,51 @@ SOURCES = [
 
 TOP_K_DEFAULT = 7
 
+# ---- Параллельная загрузка лент (app.fetchers.rss_html.fetch_all_async) ----
+FETCH_CONCURRENCY   = 8     # одновременных запросов к лентам
+FETCH_SOURCE_S      = 12.0  # дедлайн на один источник (с ретраями и парсингом)
+FETCH_DEADLINE_S    = 20.0  # общий дедлайн: что не успело — пропускаем
+
+# ---- Общий кэш результатов бота (app.core.cache) ----
+RESULT_TTL_S = 60  # одинаковые (окно, topK) в течение минуты — один прогон пайплайна
+
+# ---- Пулы исполнителей (app.core.workers) ----
+IO_WORKERS  = int(os.getenv("RADAR_IO_WORKERS", "4"))   # потоки: сеть, SQLite, сборка карточек
+CPU_WORKERS = int(os.getenv("RADAR_CPU_WORKERS", "1"))  # процессы: эмбеддинги и сюжеты (каждый держит свою модель)
+
+# ---- Эмбеддинги (app.nlp.embeddings) ----
+EMBED_BACKEND = os.getenv("RADAR_EMBED_BACKEND", "torch")  # torch — как раньше; onnx — ONNX Runtime + динамический int8
+ONNX_QCONFIG  = os.getenv("RADAR_ONNX_QCONFIG", "avx2")    # avx2 | avx512 | avx512_vnni | arm64 — под CPU хоста
+MODEL_DIR     = os.path.join(os.getcwd(), "data", "models")  # сюда один раз экспортируется квантованная модель
+WARMUP_MODEL  = os.getenv("RADAR_WARMUP", "1") == "1"  # бот грузит модель в фоне сразу после init_db()
+
+# ---- Хранение: горячее окно и архив (app.storage.retention) ----
+HOT_HOURS          = int(os.getenv("RADAR_HOT_HOURS", str(7*24)))  # ≥ макс. окна запроса (48ч) + STORY_LOOKBACK_H
+RETENTION_EVERY_S  = 3600   # как часто ingestor переносит старое в архив и чистит WAL/страницы
+VACUUM_PAGES       = 2000   # страниц за один incremental_vacuum
+
+# ---- Фоновый сбор (app.core.ingestor) ----
+INGEST_IN_BOT   = os.getenv("RADAR_INGEST_IN_BOT", "1") == "1"  # 0 — если ingestor запущен отдельным процессом
+INGEST_TICK_S   = 5      # как часто планировщик проверяет, кому пора опрашиваться
+INGEST_MAX_BACKOFF_S = 3600  # потолок паузы для источника, который падает подряд
+
+# ---- Дашборд Streamlit (app.web) ----
+WEB_REFRESH_S = 15   # выдача пересчитывается раз в столько секунд на процесс, сколько бы ни было зрителей
+WEB_PAGE_SIZE = 10   # карточек на странице по умолчанию
+INGEST_IN_WEB = os.getenv("RADAR_INGEST_IN_WEB", "0") == "1"  # 1 — дашборд сам держит фоновый сбор (без бота)
+
+# ---- Push-алерты по подпискам (app.core.alerts) ----
+ALERT_EVERY_S      = 15    # как часто проверять подписки, если ingestor не разбудил раньше
+ALERT_WINDOW_H     = 6     # алертим только сюжеты с публикациями за последние часы
+ALERT_SCAN         = 200   # сколько лучших сюжетов окна сверять с подписками
+ALERT_MAX_PER_HOUR = 6     # лимит алертов на пользователя
+ALERT_HOT_DEFAULT    = 0.70  # /sub hot без порога
+ALERT_TICKER_DEFAULT = 0.55  # /sub SBER без порога
+
+# ---- Замеры стадий (app.core.profiler) ----
+METRICS_PORT  = int(os.getenv("RADAR_METRICS_PORT", "0"))  # >0 — бот отдаёт Prometheus-метрики на :PORT/metrics
+PROFILE_ADMINS = {int(x) for x in os.getenv("RADAR_ADMIN_IDS", "").replace(",", " ").split()}  # кому доступна /profile
+
 # ---- Веса факторов горячести (используются в combine_logistic) ----
 HOTNESS_WEIGHTS = {
     "recency":       0.80,   # свежесть
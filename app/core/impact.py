@@ -1,9 +1,47 @@
+import time
+import asyncio
+import threading
 import datetime as dt
+from collections import OrderedDict
 import statistics as st
 import httpx
 from httpx import HTTPError, RemoteProtocolError
 
+from app.core.aio import run_sync
+from app.core.profiler import span, count, timed
+from app.storage.candles import sync_state, save_candles, load_candles
+
 HEADERS = {"User-Agent": "RadarBot/1.0 (+moex-iss; httpx)"}
+ISS = "https://iss.moex.com/iss"
+
+CANDLE_INTERVAL  = 60   # часовые бары
+CANDLE_DAYS      = 30   # база для vol×/σ
+CANDLE_REFRESH_S = 60   # чаще этого ISS по одной бумаге не дёргаем — отвечаем из кэша
+ISS_PAGE         = 500  # ISS отдаёт свечи страницами по 500
+
+IMPACT_CONCURRENCY = 6    # параллельных запросов к ISS
+IMPACT_DEADLINE_S  = 8.0  # общий дедлайн: не успели — метрики n/a, карточки не ждут
+IMPACT_TTL_S     = 120  # межзапросный кэш метрик: в пределах TTL метрики серии считаем одинаковыми
+IMPACT_CACHE_MAX = 512
+
+# один пул keep-alive соединений на процесс вместо нового клиента на каждый запрос;
+# создаётся при первом запросе, а не на импорте модуля
+_client = None
+_transport = None
+_client_lock = threading.Lock()
+
+def client() -> httpx.Client:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = httpx.Client(headers=HEADERS, timeout=15, transport=_transport)
+        return _client
+
+def use_transport(transport):
+    """Все запросы к ISS — через transport (бенчмарки: httpx.MockTransport); None — снова в сеть."""
+    global _client, _transport
+    with _client_lock:
+        _client, _transport = None, transport
 
 # Алиасы «читаемых» кодов к реальным SECID на ISS для валют TOM
 FX_ALIASES = {
@@ -12,31 +50,111 @@ FX_ALIASES = {
     "CNYRUB_TOM": "CNY000UTSTOM",
 }
 
-def _fetch_json(url: str):
+def _fetch_json(url: str, params=None):
     # 3 попытки с экспоненциальной паузой; любые сетевые ошибки -> None
     delay = 0.6
-    for _ in range(3):
+    for i in range(3):
         try:
-            with httpx.Client(http2=True, headers=HEADERS, timeout=15) as c:
-                r = c.get(url)
-                r.raise_for_status()
-                return r.json()
+            count("impact.requests")
+            r = client().get(url, params=params)
+            r.raise_for_status()
+            return r.json()
         except (HTTPError, RemoteProtocolError, Exception):
-            import time
+            count("impact.retries" if i < 2 else "impact.failures")
             time.sleep(delay)
             delay = min(delay * 2, 4.0)
     return None
 
-def _candles(engine: str, market: str, secid: str, start_iso: str):
-    url = f"https://iss.moex.com/iss/engines/{engine}/markets/{market}/securities/{secid}/candles.json?from={start_iso}&interval=60"
-    js = _fetch_json(url)
-    if not js or "candles" not in js or not js["candles"]["data"]:
-        return [], []
+def _candles_url(engine: str, market: str, secid: str) -> str:
+    return f"{ISS}/engines/{engine}/markets/{market}/securities/{secid}/candles.json"
+
+def _parse_candles(js):
+    """JSON ISS → [(begin, close, volume)] или None, если ответ битый."""
+    if not js or "candles" not in js:
+        return None
     cols = js["candles"]["columns"]; data = js["candles"]["data"]
-    i_close = cols.index("close"); i_vol = cols.index("volume")
-    closes = [r[i_close] for r in data if r[i_close] is not None]
-    vols   = [r[i_vol]   for r in data if r[i_vol]   is not None]
-    return closes, vols
+    i_close = cols.index("close"); i_vol = cols.index("volume"); i_beg = cols.index("begin")
+    return [(r[i_beg], r[i_close], r[i_vol]) for r in data]
+
+def _iss_candles(engine: str, market: str, secid: str, start: str):
+    """Все бары с start (с постраничной догрузкой). None — если ISS недоступен."""
+    bars = []
+    for page in range(20):
+        js = _fetch_json(_candles_url(engine, market, secid),
+                         {"from": start, "interval": CANDLE_INTERVAL, "start": page * ISS_PAGE})
+        chunk = _parse_candles(js)
+        if chunk is None:
+            return None if page == 0 else bars
+        bars += chunk
+        if len(chunk) < ISS_PAGE:
+            break
+    return bars
+
+def _sync_candles(engine: str, market: str, secid: str, start30: str, now_ts: int):
+    """Докачивает в кэш только бары новее последнего сохранённого."""
+    key = (engine, market, secid, CANDLE_INTERVAL)
+    last, synced = sync_state(key)
+    if now_ts - synced < CANDLE_REFRESH_S:
+        return
+    frm = last if last and last >= start30 else start30
+    bars = _iss_candles(engine, market, secid, frm)
+    if bars is None:
+        return  # сеть упала — считаем по тому, что уже есть в кэше
+    save_candles(key, bars, now_ts, keep_from=start30)
+
+# ---------------------------- async-путь ----------------------------
+
+async def _fetch_json_async(ac: httpx.AsyncClient, url: str, params=None):
+    delay = 0.6
+    for i in range(3):
+        try:
+            count("impact.requests")
+            r = await ac.get(url, params=params)
+            r.raise_for_status()
+            return r.json()
+        except Exception:
+            count("impact.retries" if i < 2 else "impact.failures")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 4.0)
+    return None
+
+async def _sync_candles_async(ac: httpx.AsyncClient, engine: str, market: str, secid: str,
+                              start30: str, now_ts: int):
+    key = (engine, market, secid, CANDLE_INTERVAL)
+    last, synced = await asyncio.to_thread(sync_state, key)
+    if now_ts - synced < CANDLE_REFRESH_S:
+        return
+    frm = last if last and last >= start30 else start30
+    bars = []
+    for page in range(20):
+        js = await _fetch_json_async(ac, _candles_url(engine, market, secid),
+                                     {"from": frm, "interval": CANDLE_INTERVAL, "start": page * ISS_PAGE})
+        chunk = _parse_candles(js)
+        if chunk is None:
+            if page == 0:
+                return
+            break
+        bars += chunk
+        if len(chunk) < ISS_PAGE:
+            break
+    await asyncio.to_thread(save_candles, key, bars, now_ts, start30)
+
+async def _prefetch_series(series, start30: str, now_ts: int, deadline_s: float, concurrency: int):
+    """Параллельно докачивает серии; возвращает множество серий, успевших к дедлайну."""
+    sem = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(headers=HEADERS, timeout=deadline_s, transport=_transport,
+                                 limits=httpx.Limits(max_connections=concurrency)) as ac:
+        async def one(sk):
+            async with sem:
+                await _sync_candles_async(ac, *sk, start30, now_ts)
+        tasks = {asyncio.create_task(one(sk)): sk for sk in series}
+        if not tasks:
+            return set()
+        done, pending = await asyncio.wait(tasks, timeout=deadline_s)
+        for t in pending:
+            t.cancel()
+        count("impact.deadline_miss", len(pending))
+        return {tasks[t] for t in done if not t.exception()}
 
 def _detect_engine_market(secid: str):
     """
@@ -53,19 +171,30 @@ def _detect_engine_market(secid: str):
     # По умолчанию — акции
     return ("stock", "shares"), s
 
-def price_impact_metrics(secid: str, window_hours: int, now_ts: int):
+def _start30(now_ts: int) -> str:
+    return (dt.datetime.utcfromtimestamp(now_ts) - dt.timedelta(days=CANDLE_DAYS)).date().isoformat()
+
+@timed("impact.metrics")
+def price_impact_metrics(secid: str, window_hours: int, now_ts: int, fetch: bool = True):
     """
     Возвращает (pct_move, volume_ratio, price_anomaly) или (None, None, None) при недоступности данных.
+    fetch=False — считать только по кэшу свечей (после prefetch_impacts).
     """
     try:
         if not secid:
             return None, None, None
         (engine, market), secid_real = _detect_engine_market(secid)
         start   = dt.datetime.utcfromtimestamp(now_ts - window_hours*3600).date().isoformat()
-        start30 = (dt.datetime.utcfromtimestamp(now_ts) - dt.timedelta(days=30)).date().isoformat()
+        start30 = _start30(now_ts)
 
-        closes30, vols30 = _candles(engine, market, secid_real, start30)
-        closesW,  volsW  = _candles(engine, market, secid_real, start)
+        # одна серия из кэша: окно — её хвост с даты start
+        if fetch:
+            _sync_candles(engine, market, secid_real, start30, now_ts)
+        bars = load_candles((engine, market, secid_real, CANDLE_INTERVAL), start30)
+        closes30 = [c for _, c, _ in bars if c is not None]
+        vols30   = [v for _, _, v in bars if v is not None]
+        closesW  = [c for b, c, _ in bars if b >= start and c is not None]
+        volsW    = [v for b, _, v in bars if b >= start and v is not None]
         if len(closes30) < 3 or len(closesW) < 2:
             return None, None, None
 
@@ -89,3 +218,82 @@ def price_impact_metrics(secid: str, window_hours: int, now_ts: int):
         return pct_move, volume_ratio, price_anomaly
     except Exception:
         return None, None, None
+
+# ---------------------------- мемоизация ----------------------------
+
+_cache: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (stored_at, metrics)
+_cache_lock = threading.Lock()
+
+def impact_key(secid: str, window_hours: int, now_ts: int):
+    """
+    Ключ по реальному SECID ISS: USDRUB_TOM и USD000UTSTOM — одна серия.
+    now_ts в ключ не входит: свежесть задаёт только IMPACT_TTL_S (все вызовы — на «сейчас»).
+    """
+    (engine, market), secid_real = _detect_engine_market(secid)
+    return (engine, market, secid_real, window_hours)
+
+def _remember(key, res):
+    if res != (None, None, None):  # отказ ISS не закрепляем за пределами запроса
+        with _cache_lock:
+            _cache[key] = (time.time(), res)
+            _cache.move_to_end(key)
+            while len(_cache) > IMPACT_CACHE_MAX:
+                _cache.popitem(last=False)
+    return res
+
+def cached_impact_metrics(secid: str, window_hours: int, now_ts: int, memo=None):
+    """
+    price_impact_metrics с двумя уровнями кэша:
+    memo — словарь на один build_events (повтор тикера = ноль запросов),
+    _cache — короткий LRU с TTL между запросами.
+    """
+    key = impact_key(secid, window_hours, now_ts)
+    if memo is not None and key in memo:
+        count("impact.memo_hit")
+        return memo[key]
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit and time.time() - hit[0] < IMPACT_TTL_S:
+            _cache.move_to_end(key)
+            res = hit[1]
+        else:
+            res = None
+    count("impact.cache_hit" if res is not None else "impact.cache_miss")
+    if res is None:
+        res = _remember(key, price_impact_metrics(secid, window_hours, now_ts))
+    if memo is not None:
+        memo[key] = res
+    return res
+
+def prefetch_impacts(pairs, now_ts: int, memo: dict,
+                     deadline_s: float = IMPACT_DEADLINE_S, concurrency: int = IMPACT_CONCURRENCY):
+    """
+    Считает метрики для всех (secid, окно) разом: свечи по уникальным сериям
+    качаются параллельно, результат кладётся в memo (см. cached_impact_metrics).
+    Серии, не успевшие к дедлайну, получают (None, None, None).
+    """
+    todo = {}
+    for secid, window_hours in pairs:
+        if not secid:
+            continue
+        key = impact_key(secid, window_hours, now_ts)
+        if key in memo:
+            continue
+        with _cache_lock:
+            hit = _cache.get(key)
+        if hit and time.time() - hit[0] < IMPACT_TTL_S:
+            count("impact.cache_hit")
+            memo[key] = hit[1]
+            continue
+        todo[key] = (secid, window_hours)
+    if not todo:
+        return
+    count("impact.cache_miss", len(todo))
+    series = {k[:3] for k in todo}
+    with span("impact.prefetch"):
+        ok = run_sync(_prefetch_series(series, _start30(now_ts), now_ts, deadline_s, concurrency))
+    for key, (secid, window_hours) in todo.items():
+        if key[:3] not in ok:
+            memo[key] = (None, None, None)
+            continue
+        memo[key] = _remember(key, price_impact_metrics(secid, window_hours, now_ts, fetch=False))
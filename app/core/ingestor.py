@@ -0,0 +1,124 @@
+"""
+Фоновый сбор RSS → SQLite.
+
+Держит таблицу articles свежей, чтобы build_events(fetch=False) читал только из БД.
+Запуск отдельным процессом:  python -m app.core.ingestor
+Либо как задача внутри бота (см. app.bot.main, INGEST_IN_BOT).
+"""
+import time, asyncio, logging
+from typing import List, Dict
+
+from app.core.config import SOURCES, Source, INGEST_TICK_S, INGEST_MAX_BACKOFF_S, RETENTION_EVERY_S
+from app.core.aio import run_sync
+from app.fetchers.rss_html import fetch_sources_async
+from app.storage.ingest import upsert_articles, save_feed_state
+from app.storage.db import init_db
+from app.storage.retention import run_retention
+from app.scoring.materialized import refresh_stories
+from app.core.impact import IMPACT_TTL_S
+from app.core.workers import run_io, run_cpu, index_pending
+
+log = logging.getLogger("radar.ingest")
+
+
+class Ingestor:
+    """Планировщик с собственным периодом опроса у каждого источника."""
+
+    def __init__(self, sources: List[Source] = SOURCES):
+        self.sources = list(sources)
+        self.next_due: Dict[str, float] = {s.name: 0.0 for s in self.sources}
+        self.fails: Dict[str, int] = {}
+        self.retention_due = time.time() + RETENTION_EVERY_S
+        self.scores_due = 0.0
+        self.updated = asyncio.Event()  # сюжеты пересчитаны — будит рассылку алертов в боте
+
+    def due(self, now: float) -> List[Source]:
+        return [s for s in self.sources if self.next_due[s.name] <= now]
+
+    async def tick_async(self) -> int:
+        """Параллельно опрашивает источники, у которых подошёл срок. Возвращает число новых статей."""
+        due = self.due(time.time())
+        if not due:
+            return 0
+        results = await fetch_sources_async(due)
+        added = 0
+        for s in due:
+            res = results.get(s.name)
+            if isinstance(res, BaseException) or res is None:
+                # падающий источник (404 у РБК и т.п.) опрашиваем всё реже, остальные не ждут
+                f = self.fails.get(s.name, 0) + 1
+                self.fails[s.name] = f
+                self.next_due[s.name] = time.time() + min(s.poll_s * 2**f, INGEST_MAX_BACKOFF_S)
+                log.warning("ingest %s failed (%d подряд): %r", s.name, f, res)
+                continue
+            items, state = res
+            n = await run_io(upsert_articles, items)
+            if state:
+                # только после записи статей: иначе следующий опрос получит 304 и они потеряются
+                await run_io(save_feed_state, s.name, **state)
+            added += n
+            self.fails.pop(s.name, None)
+            self.next_due[s.name] = time.time() + s.poll_s
+            if n:
+                log.info("ingest %s: +%d", s.name, n)
+        if added:
+            # векторы и сюжеты считаем один раз при сборе (в процессе-воркере), а не на каждый запрос
+            try:
+                await run_cpu(index_pending)
+            except Exception:
+                log.exception("indexing failed")
+            self.scores_due = 0.0  # новые статьи в сюжетах — признаки пересчитать сразу
+        return added
+
+    def tick(self) -> int:
+        return run_sync(self.tick_async())
+
+    async def scores_async(self):
+        """Материализованные признаки сюжетов: после индексации и раз в IMPACT_TTL_S (новые свечи)."""
+        if time.time() < self.scores_due:
+            return
+        self.scores_due = time.time() + IMPACT_TTL_S
+        try:
+            if any(await run_io(refresh_stories)):
+                self.updated.set()
+        except Exception:
+            log.exception("story scores refresh failed")
+
+    async def maintain_async(self):
+        """Раз в RETENTION_EVERY_S: старое — в архив, WAL — checkpoint, страницы — vacuum."""
+        if time.time() < self.retention_due:
+            return
+        self.retention_due = time.time() + RETENTION_EVERY_S
+        self.scores_due = 0.0
+        try:
+            await run_io(run_retention)
+        except Exception:
+            log.exception("retention failed")
+
+    def sleep_for(self) -> float:
+        wait = min(self.next_due.values(), default=time.time() + INGEST_TICK_S) - time.time()
+        return max(1.0, min(wait, INGEST_TICK_S))
+
+    def run_forever(self):
+        while True:
+            self.tick()
+            run_sync(self.scores_async())
+            run_sync(self.maintain_async())
+            time.sleep(self.sleep_for())
+
+    async def run_async(self):
+        # сеть — на event loop бота (async), trafilatura и SQLite — в потоках, модель — в процессе
+        while True:
+            try:
+                await self.tick_async()
+                await self.scores_async()
+                await self.maintain_async()
+            except Exception:
+                log.exception("ingest tick error")
+            await asyncio.sleep(self.sleep_for())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    Ingestor().run_forever()
@@ -1,46 +1,40 @@
-import time, hashlib
+import time, json
 from collections import defaultdict
-from typing import List, Dict
+from typing import Dict, Iterator, List, Tuple
 
 from app.core.config import SOURCES, HOTNESS_WEIGHTS, TOP_K_DEFAULT
 from app.fetchers.rss_html import fetch_all
-from app.storage.ingest import upsert_articles
+from app.storage.ingest import upsert_articles, extract_pending, save_feed_state
 from app.storage.db import get_db
-from app.nlp.entities import extract_secids
-from app.nlp.embeddings import embed_texts, cluster_texts
-from app.nlp.topics import (
-    infer_targets, relevance_score, company_secids, REL_MIN
-)
+from app.nlp.embeddings import ensure_embeddings, article_text, EMBED_TAG
+from app.nlp.stories import assign_pending
+from app.nlp.topics import REL_MIN
+from app.nlp.matcher import stored_matches
 from app.scoring.hotness import (
     recency_score, velocity_score, credibility_score, confirmations_score,
-    breadth_score, norm_clip, combine_logistic
+    breadth_score, norm_clip, combine_logistic, top_k_indices
 )
-from app.core.impact import price_impact_metrics
+from app.scoring.materialized import refresh_stories, refresh_impacts, top_stories, live_features, story_secids
+from app.core.impact import cached_impact_metrics, prefetch_impacts
+from app.core.profiler import span, count, timed
 
 MIN_RETURN = 5         # минимум карточек
 EXTRA_THRESHOLD = 0.62 # добавляем сверх лимита, если hotness высокий
+EXTRA_MAX = 10         # сколько сверх лимита максимум
 
 
-def _hash_titles(titles:List[str]) -> str:
-    return hashlib.sha1(("||".join(sorted(set(titles)))).encode()).hexdigest()[:16]
+_COLS = "id, source, url, title, published_ts, lang, summary, cred_weight, source_group, entities"
 
-def _validity(cred_scores, groups, max_age_ts, now_ts):
-    cred = credibility_score(cred_scores)
-    conf = confirmations_score(groups)
-    rec  = recency_score(max_age_ts, now_ts)
-    return round((0.5*cred + 0.3*conf + 0.2*rec), 3)
+def _row_matches(row):
+    return stored_matches(row[9] if len(row) > 9 else None, (row[3] or '')+' '+(row[6] or ''))
 
-def _ensure_secids(text: str, rel: float):
-    secids = extract_secids(text) or company_secids(text) or infer_targets(text)
-    # last-resort: даже при низкой релевантности даём базовый прокси рынка
-    if not secids:
-        secids = ["USDRUB_TOM"]
-    return secids
+def _impact_window(hours):
+    return min(6, hours)
 
-def _calc_impact(secids, hours, now):
+def _calc_impact(secids, hours, now, memo=None):
     if not secids:
         return {"pct_move":None,"volume_ratio":None,"price_anomaly":None}
-    pct, vr, pa = price_impact_metrics(secids[0], min(6, hours), now)
+    pct, vr, pa = cached_impact_metrics(secids[0], _impact_window(hours), now, memo)
     return {"pct_move":pct,"volume_ratio":vr,"price_anomaly":pa}
 
 def _features_base(ts_list, now, cred_list, groups, secids, rel):
@@ -53,14 +47,18 @@ def _features_base(ts_list, now, cred_list, groups, secids, rel):
         "relevance":     rel
     }
 
-def _event_from_single(row, now, hours, rel_min):
-    _id, source, url, title, ts, lang, summary, cred, group = row
-    text=(title or '')+' '+(summary or '')
-    rel = relevance_score(text)
+def _single_pick(row, rel_min):
+    """Текстовая часть одиночного события: (rel, secids) или None, если шум."""
+    group = row[8]
+    m = _row_matches(row)
+    rel = m.relevance
     if rel < rel_min and group not in ('REG','EXCH'):
         return None
-    secids = _ensure_secids(text, rel)
-    imp = _calc_impact(secids, hours, now)
+    return rel, story_secids(m)
+
+def _event_from_single(row, now, hours, rel, secids, memo=None, imp=None):
+    _id, source, url, title, ts, lang, summary, cred, group = row[:9]
+    imp = imp or _calc_impact(secids, hours, now, memo)
     feats=_features_base([ts], now, [cred], [group], secids, rel)
     feats["price_move"]    = norm_clip(abs(imp["pct_move"]) if imp["pct_move"] is not None else None, 0.5, 6.0)
     feats["volume_ratio"]  = norm_clip(imp["volume_ratio"], 0.8, 3.0)
@@ -81,26 +79,88 @@ def _event_from_single(row, now, hours, rel_min):
         't0': ts, 't1': ts
     }
 
-def _fallback(rows, now:int, hours:int, need:int):
-    """Многоступенчатый фоллбек: REL_MIN → 0.25 → 0.0 (но только REG/EXCH/TIER1)."""
+def _event_from_cluster(cand, imp, feats, hotness, validity):
+    sid, arts, uniq_groups, uniq_sources, secids, rel = cand
+    t0, t1 = min(a["published_ts"] for a in arts), max(a["published_ts"] for a in arts)
+    timeline=sorted(
+        [{"t":a["published_ts"],"source":a["source"],"url":a["url"],"title":a["title"]} for a in arts],
+        key=lambda x:x["t"]
+    )
+    headline = max(arts, key=lambda a:(a["cred_weight"], len(a["title"] or "")))["title"][:180]
+    why = f"Публикации из {len(uniq_sources)} источников ({', '.join(sorted(uniq_groups))})."
+
+    seen=set(); sources=[]
+    for a in arts:
+        if a["source"] in seen: continue
+        seen.add(a["source"]); sources.append({"url":a["url"], "source":a["source"]})
+        if len(sources)>=5: break
+
+    return {
+        "dedup_group": f"s{sid}",  # id сюжета из SQLite — стабилен между запросами
+        "headline": headline,
+        "hotness": hotness,
+        "why_now": why,
+        "secids": secids,
+        "sources": sources,
+        "timeline": timeline,
+        "articles": arts,
+        "features": feats,
+        "validity": validity,
+        "impact": imp,
+        "t0": t0, "t1": t1
+    }
+
+def story_events(top, since_ts:int, now:int) -> List[Dict]:
+    """Карточки для строк top_stories: статьи сюжета в окне (с since_ts) + материализованные признаки."""
+    arts = defaultdict(list)
+    if top:
+        with get_db() as conn:
+            for r in conn.execute(f"""
+             SELECT m.story_id, a.id, a.source, a.url, a.title, a.published_ts, a.summary, a.cred_weight, a.source_group
+             FROM story_members m JOIN articles a ON a.id=m.article_id
+             WHERE m.story_id IN ({','.join('?'*len(top))}) AND a.published_ts>=?
+             ORDER BY a.published_ts DESC
+            """, (*[t[0] for t in top], since_ts)):
+                arts[r[0]].append({
+                    "id":r[1],"source":r[2],"url":r[3],"title":r[4],
+                    "published_ts":r[5],"summary":r[6],
+                    "cred_weight":r[7],"group":r[8]
+                })
+
+    events=[]
+    for sid, hot, val, feats, tail_ts, last_ts, secids, pct, vr, pa in top:
+        a = arts.get(sid)
+        if not a or not any(x["title"] for x in a):
+            continue
+        f = live_features(json.loads(feats), last_ts, tail_ts, now)
+        cand = (sid, a, {x["group"] for x in a}, {x["source"] for x in a}, json.loads(secids), f["relevance"])
+        imp = {"pct_move":pct, "volume_ratio":vr, "price_anomaly":pa}
+        events.append(_event_from_cluster(cand, imp, f, hot, val))
+    return events
+
+def _fallback(rows, now:int, hours:int, need:int, memo=None, impacts:bool=True):
+    """
+    Многоступенчатый фоллбек: REL_MIN → 0.25 → 0.0 (но только REG/EXCH/TIER1).
+    impacts=False — без запросов к ISS (метрики n/a): предварительная выдача stream_events.
+    """
     prio={'REG':3,'EXCH':2,'TIER1':1}
     rows_sorted = sorted(rows, key=lambda r:(prio.get(r[8],0), r[7], r[4]), reverse=True)
+    # отбор строк не зависит от рыночных метрик — сначала выбираем, потом разом считаем метрики
     out=[]; seen_urls=set(); seen_titles=set()
 
     def try_level(rel_min):
-        nonlocal out
         for r in rows_sorted:
             if len(out) >= need: break
             if not r[2] or r[2] in seen_urls: 
                 continue
-            ev = _event_from_single(r, now, hours, rel_min)
-            if not ev: 
+            pick = _single_pick(r, rel_min)
+            if not pick: 
                 continue
-            title_key = ev['headline'].lower().strip()
+            title_key = (r[3] or 'Событие')[:180].lower().strip()
             if title_key in seen_titles: 
                 continue
             seen_titles.add(title_key)
-            seen_urls.add(r[2]); out.append(ev)
+            seen_urls.add(r[2]); out.append((r, *pick))
 
     # уровень 1: базовый порог релевантности
     try_level(REL_MIN)
@@ -115,119 +175,111 @@ def _fallback(rows, now:int, hours:int, need:int):
                 continue
             if not r[2] or r[2] in seen_urls: 
                 continue
-            ev = _event_from_single(r, now, hours, 0.0)
-            if not ev: 
+            pick = _single_pick(r, 0.0)
+            if not pick: 
                 continue
-            title_key = ev['headline'].lower().strip()
+            title_key = (r[3] or 'Событие')[:180].lower().strip()
             if title_key in seen_titles: 
                 continue
-            seen_titles.add(title_key); seen_urls.add(r[2]); out.append(ev)
-    return out
+            seen_titles.add(title_key); seen_urls.add(r[2]); out.append((r, *pick))
 
-def build_events(hours:int=24, top_k:int=TOP_K_DEFAULT) -> List[Dict]:
-    items = fetch_all(SOURCES)
-    upsert_articles(items)
+    if not impacts:
+        none = {"pct_move":None,"volume_ratio":None,"price_anomaly":None}
+        return [_event_from_single(r, now, hours, rel, secids, imp=none) for r, rel, secids in out]
+    if memo is None:
+        memo = {}
+    prefetch_impacts([(secids[0], _impact_window(hours)) for _, _, secids in out if secids], now, memo)
+    return [_event_from_single(r, now, hours, rel, secids, memo) for r, rel, secids in out]
 
-    now=int(time.time())
-    window_ts=now - hours*3600
+def _snapshot(window_ts:int, now:int, hours:int, need:int, impacts:bool=True):
+    """Выдача на момент now: сюжеты + фоллбек до need + ранжирование. Возвращает (события, сколько из фоллбека)."""
+    # лучшие сюжеты окна — один запрос; hotness/validity досчитываются SQL-функциями на момент now
+    with span("build.top_stories"):
+        top = top_stories(window_ts, now, need + EXTRA_MAX)
+    with span("build.cards"):
+        events = story_events(top, window_ts, now)
+    count("build.stories", len(events))
 
-    with get_db() as conn:
-        rows = conn.execute("""
-         SELECT id, source, url, title, published_ts, lang, summary, cred_weight, source_group
-         FROM articles WHERE published_ts>=? ORDER BY published_ts DESC
-        """, (window_ts,)).fetchall()
-    if not rows:
-        return []
-
-    texts=[(r[3] or "") + " " + (r[6] or "") for r in rows]
-    embeds=embed_texts(texts)
-    labels=cluster_texts(embeds)
-
-    clusters=defaultdict(list)
-    for lab, r in zip(labels, rows):
-        clusters[int(lab)].append({
-            "id":r[0],"source":r[1],"url":r[2],"title":r[3],
-            "published_ts":r[4],"summary":r[6],
-            "cred_weight":r[7],"group":r[8]
-        })
-
-    events=[]
-    for _, arts in clusters.items():
-        if not arts: 
-            continue
+    # гарантированный минимум карточек
+    fb = []
+    if len(events) < need:
+        with span("build.fallback"):
+            with get_db() as conn:
+                rows_f = conn.execute(
+                    f"""
+                    SELECT {_COLS}
+                    FROM articles WHERE published_ts>=? ORDER BY published_ts DESC LIMIT 400
+                    """, (window_ts,)
+                ).fetchall()
+            fb = _fallback(rows_f, now, hours, need - len(events), impacts=impacts)
+        count("build.fallback", len(fb))
+        events += fb
 
-        uniq_groups=set(a["group"] for a in arts)
-        uniq_sources=set(a["source"] for a in arts)
-        titles=[a["title"] for a in arts if a["title"]]
-        if not titles:
-            continue
+    # отбор и «умный» овершут: частичная сортировка вместо полной
+    with span("build.rank"):
+        order = top_k_indices([e["hotness"] for e in events], [e.get("validity", 0) for e in events], need + EXTRA_MAX)
+        ranked = [events[i] for i in order]
+        base = ranked[:need]
+        extra = [e for e in ranked[need:] if e["hotness"]>=EXTRA_THRESHOLD]
+    return base + extra, len(fb)
 
-        text_concat=" ".join([(a["title"] or "")+" "+(a["summary"] or "") for a in arts])
-        rel = relevance_score(text_concat)
+def stream_events(hours:int=24, top_k:int=TOP_K_DEFAULT, fetch:bool=True, embed:bool=True,
+                  provisional:bool=True) -> Iterator[Tuple[List[Dict], bool]]:
+    """
+    Выдача по мере готовности: снимки (события, final).
+    Первый снимок — сразу после текстовой части: метрики влияния сюжетов — сохранённые
+    (ingestor обновляет их каждые IMPACT_TTL_S), у одиночных событий фоллбека — n/a; ISS не ждём.
+    Затем досчитываются устаревшие метрики и приходит окончательный список (final=True) —
+    тот же, что вернул бы build_events. provisional=False — только окончательный.
+    """
+    if fetch:
+        with span("build.fetch"):
+            items, states = fetch_all(SOURCES)
+        with span("build.upsert"):
+            upsert_articles(items)
+            for name, state in states.items():
+                save_feed_state(name, **state)
 
-        # Отсечение шума (кроме REG/EXCH)
-        if rel < REL_MIN and not (("REG" in uniq_groups) or ("EXCH" in uniq_groups)):
-            continue
-        # Требование подтверждений
-        if len(uniq_sources)<2 and not (("REG" in uniq_groups) or ("EXCH" in uniq_groups)):
-            continue
+    now=int(time.time())
+    window_ts=now - hours*3600
 
-        secids = _ensure_secids(text_concat, rel)
-
-        dedup_id=_hash_titles(titles)
-        t0, t1 = min(a["published_ts"] for a in arts), max(a["published_ts"] for a in arts)
-        timeline=sorted(
-            [{"t":a["published_ts"],"source":a["source"],"url":a["url"],"title":a["title"]} for a in arts],
-            key=lambda x:x["t"]
-        )
-
-        ts_list=[a["published_ts"] for a in arts]
-        feats=_features_base(ts_list, now, [a["cred_weight"] for a in arts], [a["group"] for a in arts], secids, rel)
-        imp=_calc_impact(secids, hours, now)
-        feats["price_move"]    = norm_clip(abs(imp["pct_move"]) if imp["pct_move"] is not None else None, 0.5, 6.0)
-        feats["volume_ratio"]  = norm_clip(imp["volume_ratio"], 0.8, 3.0)
-        feats["price_anomaly"] = norm_clip(imp["price_anomaly"], 1.0, 4.0)
-
-        hotness = combine_logistic(HOTNESS_WEIGHTS, feats)
-        validity = _validity([a["cred_weight"] for a in arts], [a["group"] for a in arts], max(ts_list), now)
-        headline = max(arts, key=lambda a:(a["cred_weight"], len(a["title"] or "")))["title"][:180]
-        why = f"Публикации из {len(uniq_sources)} источников ({', '.join(sorted(uniq_groups))})."
-
-        seen=set(); sources=[]
-        for a in arts:
-            if a["source"] in seen: continue
-            seen.add(a["source"]); sources.append({"url":a["url"], "source":a["source"]})
-            if len(sources)>=5: break
-
-        events.append({
-            "dedup_group": dedup_id,
-            "headline": headline,
-            "hotness": hotness,
-            "why_now": why,
-            "secids": secids,
-            "sources": sources,
-            "timeline": timeline,
-            "articles": arts,
-            "features": feats,
-            "validity": validity,
-            "impact": imp,
-            "t0": t0, "t1": t1
-        })
+    with span("build.extract"):
+        extract_pending()  # no-op, если всё уже извлечено при сборе
+    # векторы, сюжеты и их признаки обычно уже посчитал ingestor; здесь — только «хвост»
+    if embed:
+        with span("build.embed"):
+            with get_db() as conn:
+                tail = conn.execute("""
+                 SELECT a.id, a.title, a.summary FROM articles a
+                 LEFT JOIN embeddings e ON e.article_id=a.id AND e.model=?
+                 WHERE a.published_ts>=? AND e.article_id IS NULL
+                """, (EMBED_TAG, window_ts)).fetchall()
+            ensure_embeddings([r[0] for r in tail], [article_text(r[1], r[2]) for r in tail])
+    with span("build.stories"):
+        assign_pending()
+        refresh_stories(now, impacts=False)
 
-    # гарантированный минимум карточек
     need = max(top_k, MIN_RETURN)
-    if len(events) < need:
-        with get_db() as conn:
-            rows_f = conn.execute(
-                """
-                SELECT id, source, url, title, published_ts, lang, summary, cred_weight, source_group
-                FROM articles WHERE published_ts>=? ORDER BY published_ts DESC LIMIT 400
-                """, (window_ts,)
-            ).fetchall()
-        events += _fallback(rows_f, now, hours, need - len(events))
-
-    # сортировка и «умный» овершут
-    events.sort(key=lambda e:(e["hotness"], e.get("validity",0)), reverse=True)
-    base = events[:need]
-    extra = [e for e in events[need:need+10] if e["hotness"]>=EXTRA_THRESHOLD]
-    return base + extra
+    if provisional:
+        events, fb = _snapshot(window_ts, now, hours, need, impacts=False)
+        yield events, False
+    with span("build.impacts"):
+        stale = refresh_impacts(now)
+    if not provisional or stale or fb:
+        events, _ = _snapshot(window_ts, now, hours, need)
+    count("build.events", len(events))
+    yield events, True
+
+@timed("build_events")
+def build_events(hours:int=24, top_k:int=TOP_K_DEFAULT, fetch:bool=True, embed:bool=True) -> List[Dict]:
+    """
+    fetch=True  — сначала скачать ленты (разовый запуск, run_once).
+    fetch=False — только чтение SQLite; свежесть обеспечивает app.core.ingestor.
+    embed=False — модель не трогаем (ещё прогревается): сюжеты по сохранённым векторам,
+                  статьи без вектора попадают только в фоллбек.
+    Признаки и hotness сюжетов материализованы в stories (app.scoring.materialized).
+    Потоковый вариант (предварительные карточки до метрик ISS) — stream_events.
+    """
+    for events, _ in stream_events(hours, top_k, fetch, embed, provisional=False):
+        pass
+    return events
@@ -0,0 +1,160 @@
+"""
+Замеры стадий пайплайна: спаны времени и счётчики.
+
+    with span("fetch"): ...          # длительность стадии
+    count("fetch.items", len(items))  # сколько обработано / попаданий в кэш / ретраев
+
+Каждый замер идёт в два места:
+  • накопительные метрики процесса — metrics_text() отдаёт их в формате Prometheus
+    (бот поднимает /metrics на RADAR_METRICS_PORT);
+  • текущий прогон, если он открыт через trace() — контекстная переменная, поэтому
+    параллельные запросы бота не смешиваются, а asyncio-задачи и asyncio.to_thread
+    наследуют прогон. run_once кладёт trace().as_dict() в поле "profile".
+
+Метрики — на процесс: эмбеддинги в пуле run_cpu считаются в своих процессах.
+Разовый дамп профайлера для одного вызова — profile_call() (cProfile или pyinstrument).
+"""
+import os, time, threading, contextvars
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Optional
+
+PROFILE_DIR = os.path.join(os.getcwd(), "data", "profiles")
+
+
+class Trace:
+    """Спаны и счётчики одного прогона (build_events, команда бота)."""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.stages: Dict[str, list] = {}   # имя -> [секунды, вызовы]
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()       # сбор лент пишет из потоков asyncio.to_thread
+
+    def add(self, name, dt):
+        with self._lock:
+            s = self.stages.setdefault(name, [0.0, 0])
+            s[0] += dt; s[1] += 1
+
+    def inc(self, name, n):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "total_s": round(time.perf_counter() - self.t0, 4),
+                "stages": {k: {"s": round(v[0], 4), "calls": v[1]} for k, v in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("radar_trace", default=None)
+_lock = threading.Lock()
+_stages: Dict[str, list] = {}    # имя -> [сумма секунд, вызовы, максимум]
+_counters: Dict[str, float] = {}
+
+@contextmanager
+def trace():
+    tr = Trace()
+    token = _current.set(tr)
+    try:
+        yield tr
+    finally:
+        _current.reset(token)
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+def record(name: str, dt: float):
+    with _lock:
+        s = _stages.setdefault(name, [0.0, 0, 0.0])
+        s[0] += dt; s[1] += 1; s[2] = max(s[2], dt)
+    tr = _current.get()
+    if tr is not None:
+        tr.add(name, dt)
+
+def count(name: str, n: float = 1):
+    if not n:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+    tr = _current.get()
+    if tr is not None:
+        tr.inc(name, n)
+
+@contextmanager
+def span(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - t0)
+
+def timed(name: str):
+    """Декоратор: вся функция — один спан."""
+    def deco(fn):
+        @wraps(fn)
+        def inner(*a, **kw):
+            with span(name):
+                return fn(*a, **kw)
+        return inner
+    return deco
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            "stages": {k: {"s": round(v[0], 4), "calls": v[1], "max_s": round(v[2], 4)} for k, v in _stages.items()},
+            "counters": dict(_counters),
+        }
+
+def _label(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"')
+
+def metrics_text() -> str:
+    """Накопительные метрики процесса в текстовом формате Prometheus."""
+    snap = snapshot()
+    out = ["# HELP radar_stage_seconds Время стадий пайплайна.", "# TYPE radar_stage_seconds summary"]
+    for k, v in sorted(snap["stages"].items()):
+        out.append(f'radar_stage_seconds_sum{{stage="{_label(k)}"}} {v["s"]}')
+        out.append(f'radar_stage_seconds_count{{stage="{_label(k)}"}} {v["calls"]}')
+    out += ["# HELP radar_stage_max_seconds Самый долгий вызов стадии.", "# TYPE radar_stage_max_seconds gauge"]
+    for k, v in sorted(snap["stages"].items()):
+        out.append(f'radar_stage_max_seconds{{stage="{_label(k)}"}} {v["max_s"]}')
+    out += ["# HELP radar_events_total Счётчики: элементы, попадания в кэш, ретраи.", "# TYPE radar_events_total counter"]
+    for k, v in sorted(snap["counters"].items()):
+        out.append(f'radar_events_total{{name="{_label(k)}"}} {v}')
+    return "\n".join(out) + "\n"
+
+
+def profile_call(fn, *args, mode: str = "cprofile", out_dir: str = PROFILE_DIR, **kw):
+    """
+    Один вызов под профайлером: (результат, путь к дампу).
+    cprofile → .prof (snakeviz / pstats), pyinstrument → .html (если пакет установлен).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    name = getattr(fn, "__name__", "call")
+    if mode == "pyinstrument":
+        from pyinstrument import Profiler
+        p = Profiler()
+        p.start()
+        try:
+            res = fn(*args, **kw)
+        finally:
+            p.stop()
+        path = os.path.join(out_dir, f"{name}-{stamp}.html")
+        with open(path, "w") as f:
+            f.write(p.output_html())
+        return res, path
+    if mode != "cprofile":
+        raise ValueError(f"unknown profiler {mode!r}, expected cprofile or pyinstrument")
+    import cProfile
+    p = cProfile.Profile()
+    try:
+        res = p.runcall(fn, *args, **kw)
+    finally:
+        path = os.path.join(out_dir, f"{name}-{stamp}.prof")
+        p.dump_stats(path)
+    return res, path
@@ -2,17 +2,27 @@ import sys, json, time
 from app.storage.db import init_db
 from app.core.pipeline import build_events
 from app.core.postplay import channel_draft, trader_actions
+from app.core.profiler import trace, profile_call
 
 if __name__=="__main__":
+    # --profile[=cprofile|pyinstrument] — дамп профайлера этого прогона в data/profiles
+    prof=next((a.split("=",1)[1] if "=" in a else "cprofile" for a in sys.argv[1:] if a.startswith("--profile")), None)
+    args=[a for a in sys.argv[1:] if not a.startswith("--")]
     t0=time.time()
     init_db()
-    hours=int(sys.argv[1]) if len(sys.argv)>1 else 24
-    k=int(sys.argv[2]) if len(sys.argv)>2 else 7
-    evs=build_events(hours,k)
+    hours=int(args[0]) if len(args)>0 else 24
+    k=int(args[1]) if len(args)>1 else 7
+    dump=None
+    with trace() as tr:
+        if prof:
+            evs, dump = profile_call(build_events, hours, k, mode=prof)
+        else:
+            evs=build_events(hours,k)
     t1=time.time()
     print(json.dumps({
         "latency_s": round(t1-t0,2),
         "count": len(evs),
+        "profile": {**tr.as_dict(), **({"dump": dump} if dump else {})},
         "events":[{
             "headline":e["headline"], "hotness":e["hotness"],
             "validity":e["validity"], "impact":e["impact"],
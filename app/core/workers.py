@@ -0,0 +1,60 @@
+"""
+Пулы для тяжёлой работы вне event loop бота.
+
+run_io  — потоки: сеть, SQLite, build_events (GIL отпускается на I/O).
+run_cpu — процессы: инференс e5 и раскладка по сюжетам, чтобы не делить GIL с ботом.
+"""
+import asyncio
+import multiprocessing as mp
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from app.core.config import IO_WORKERS, CPU_WORKERS
+
+_io = None
+_cpu = None
+
+def io_pool() -> ThreadPoolExecutor:
+    global _io
+    if _io is None:
+        _io = ThreadPoolExecutor(IO_WORKERS, thread_name_prefix="radar-io")
+    return _io
+
+def cpu_pool() -> ProcessPoolExecutor:
+    global _cpu
+    if _cpu is None:
+        # spawn: torch и открытые SQLite-соединения плохо переживают fork
+        _cpu = ProcessPoolExecutor(CPU_WORKERS, mp_context=mp.get_context("spawn"))
+    return _cpu
+
+async def run_io(fn, *args, **kw):
+    # отмена await'а не убивает поток — результат просто выбрасывается
+    return await asyncio.get_running_loop().run_in_executor(io_pool(), partial(fn, *args, **kw))
+
+_END = object()
+
+async def aiter_io(gen):
+    """Async-итератор поверх синхронного генератора: каждый шаг — в пуле run_io."""
+    while True:
+        item = await run_io(next, gen, _END)
+        if item is _END:
+            return
+        yield item
+
+async def run_cpu(fn, *args, **kw):
+    # fn и аргументы должны пиклиться (функции верхнего уровня модуля)
+    return await asyncio.get_running_loop().run_in_executor(cpu_pool(), partial(fn, *args, **kw))
+
+def index_pending():
+    """Векторы + ANN-индекс + сюжеты для новых статей. Выполняется в процессе cpu_pool."""
+    from app.nlp.embeddings import embed_pending
+    from app.nlp.ann import sync_index
+    from app.nlp.stories import assign_pending
+    return embed_pending(), sync_index(), assign_pending()
+
+def shutdown():
+    global _io, _cpu
+    if _io is not None:
+        _io.shutdown(wait=False, cancel_futures=True); _io = None
+    if _cpu is not None:
+        _cpu.shutdown(wait=False, cancel_futures=True); _cpu = None
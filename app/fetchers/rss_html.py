@@ -1,19 +1,29 @@
 from __future__ import annotations
 import time
+import asyncio
+import hashlib
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple, Union
 
 import httpx
-import feedparser
-from bs4 import BeautifulSoup
 from tenacity import retry, stop_after_attempt, wait_exponential
 
-from app.core.config import Source
+from app.core.config import Source, FETCH_CONCURRENCY, FETCH_SOURCE_S, FETCH_DEADLINE_S
+from app.core.aio import run_sync
+from app.core.profiler import span, count, timed
+from app.storage.ingest import known_urls, get_feed_state
 
 # Тише для trafilatura
 logging.getLogger("trafilatura").setLevel(logging.CRITICAL)
 
-client = httpx.Client(timeout=20.0, headers={"User-Agent": "RADAR/1.0"})
+HEADERS = {"User-Agent": "RADAR/1.0"}
+client = httpx.Client(timeout=20.0, headers=HEADERS)
+_transport: Optional[httpx.BaseTransport] = None
+
+def use_transport(transport: Optional[httpx.BaseTransport]):
+    """Все запросы к лентам — через transport (бенчмарки: httpx.MockTransport); None — снова в сеть."""
+    global client, _transport
+    client, _transport = httpx.Client(timeout=20.0, headers=HEADERS, transport=transport), transport
 
 STOP_PATTERNS_IN_TITLE = [
     "скачать приложение", "rss", "лента", "подпис", "подробнее",
@@ -30,13 +40,23 @@ def good_title(t: str) -> bool:
         return False
     return True
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=8))
-def _rss(url: str):
-    # Качаем через httpx с нормальным UA (меньше 403/редиректов), потом парсим.
-    resp = client.get(url, follow_redirects=True)
-    resp.raise_for_status()
-    text = resp.text
-    return feedparser.parse(text)
+def _cond_headers(state: Optional[Dict]) -> Dict[str, str]:
+    # Conditional GET: сервер ответит 304 без тела, если лента не менялась
+    h: Dict[str, str] = {}
+    if state and state.get("etag"):
+        h["If-None-Match"] = state["etag"]
+    if state and state.get("last_modified"):
+        h["If-Modified-Since"] = state["last_modified"]
+    return h
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=8),
+       before_sleep=lambda _: count("fetch.retries"))
+def _rss(url: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+    # Качаем через httpx с нормальным UA (меньше 403/редиректов), парсим отдельно.
+    resp = client.get(url, headers=headers, follow_redirects=True)
+    if resp.status_code != 304:
+        resp.raise_for_status()
+    return resp
 
 
 def _clean_html(html: str) -> str:
@@ -50,56 +70,173 @@ def _clean_html(html: str) -> str:
         text = trafilatura.extract(html, include_comments=False) or ""
         return text
     except Exception:
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(html, "lxml")
         return soup.get_text(" ", strip=True)
 
-def fetch_source(src: Source, limit: int = 100) -> List[Dict]:
+def _items_from_feed(src: Source, feed, limit: int) -> List[Dict]:
     items: List[Dict] = []
-    if src.kind == "rss":
-        feed = _rss(src.url)
-        for e in feed.entries[:limit]:
-            title = (e.get("title") or "").strip()
-            if not good_title(title):
-                continue
-            ts = int(time.mktime(e.published_parsed)) if getattr(e, "published_parsed", None) else int(time.time())
+    entries = feed.entries[:limit]
+    # уже сохранённые статьи пропускаем до _clean_html: INSERT OR IGNORE их всё равно отбросит
+    seen = known_urls(e.get("link") for e in entries)
+    for e in entries:
+        title = (e.get("title") or "").strip()
+        if not good_title(title) or e.get("link") in seen:
+            continue
+        ts = int(time.mktime(e.published_parsed)) if getattr(e, "published_parsed", None) else int(time.time())
+        items.append({
+            "source": src.name,
+            "url": e.get("link"),
+            "title": title[:400],
+            "published_ts": ts,
+            "lang": src.lang,
+            "summary": _clean_html(e.get("summary", "")),
+            "content": "",
+            "cred_weight": src.weight,
+            "source_group": src.group
+        })
+    return items
+
+def _items_from_html(src: Source, html: str, limit: int) -> List[Dict]:
+    # На будущее: поддержка html-страниц-лент (сейчас источники все RSS)
+    from bs4 import BeautifulSoup
+    items: List[Dict] = []
+    soup = BeautifulSoup(html, "lxml")
+    links = soup.select("a[href]")[:limit * 2]
+    seen = known_urls(a["href"] for a in links)
+    for a in links:
+        href = a["href"]
+        t = a.get_text(strip=True)
+        if href.startswith(("http://", "https://")) and good_title(t) and href not in seen:
             items.append({
                 "source": src.name,
-                "url": e.get("link"),
-                "title": title[:400],
-                "published_ts": ts,
+                "url": href,
+                "title": t[:400],
+                "published_ts": int(time.time()),
                 "lang": src.lang,
-                "summary": _clean_html(e.get("summary", "")),
+                "summary": "",
                 "content": "",
                 "cred_weight": src.weight,
                 "source_group": src.group
             })
-    else:
-        # На будущее: поддержка html-страниц-лент (сейчас источники все RSS)
-        resp = client.get(src.url)
-        soup = BeautifulSoup(resp.text, "lxml")
-        for a in soup.select("a[href]")[:limit * 2]:
-            href = a["href"]
-            t = a.get_text(strip=True)
-            if href.startswith(("http://", "https://")) and good_title(t):
-                items.append({
-                    "source": src.name,
-                    "url": href,
-                    "title": t[:400],
-                    "published_ts": int(time.time()),
-                    "lang": src.lang,
-                    "summary": "",
-                    "content": "",
-                    "cred_weight": src.weight,
-                    "source_group": src.group
-                })
     return items
 
-def fetch_all(sources: List[Source]) -> List[Dict]:
-    out: List[Dict] = []
-    for s in sources:
+FeedState = Dict[str, Optional[str]]  # etag, last_modified, body_hash — аргументы save_feed_state
+
+def _items_from_response(src: Source, resp: httpx.Response, state: Optional[Dict],
+                         limit: int) -> Tuple[List[Dict], Optional[FeedState]]:
+    """
+    304 или тело с тем же хэшем → [] без feedparser; иначе парсим.
+    Второе значение — новое состояние ленты (None — не менялось). Сохраняет его вызывающий,
+    после upsert_articles: иначе при таймауте/ошибке записи статьи потеряются до следующей правки ленты.
+    """
+    if resp.status_code == 304:
+        count("fetch.not_modified")
+        return [], None
+    new = {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified"),
+           "body_hash": hashlib.sha1(resp.content).hexdigest()}
+    if state and state.get("body_hash") == new["body_hash"]:
+        count("fetch.unchanged")
+        return [], (new if new != state else None)
+    if src.kind == "rss":
+        import feedparser  # тяжёлый импорт — только когда лента действительно изменилась
+        items = _items_from_feed(src, feedparser.parse(resp.text), limit)
+    else:
+        items = _items_from_html(src, resp.text, limit)
+    count("fetch.items", len(items))
+    return items, new
+
+def fetch_source(src: Source, limit: int = 100) -> Tuple[List[Dict], Optional[FeedState]]:
+    state = get_feed_state(src.name)
+    resp = _rss(src.url, _cond_headers(state))
+    return _items_from_response(src, resp, state, limit)
+
+# ---------------------------- async-путь ----------------------------
+
+async def _get_async(ac: httpx.AsyncClient, url: str, headers: Optional[Dict[str, str]] = None,
+                     attempts: int = 3) -> httpx.Response:
+    # 4xx (404 у РБК) не ретраим; сетевые сбои/5xx — коротко, дедлайн всё равно ограничит
+    delay = 0.5
+    for i in range(attempts):
         try:
-            out.extend(fetch_source(s))
-        except Exception:
-            # не валим пайплайн из-за одного источника
-            continue
+            resp = await ac.get(url, headers=headers, follow_redirects=True)
+            if resp.status_code != 304:
+                resp.raise_for_status()
+            return resp
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code < 500 or i == attempts - 1:
+                raise
+        except httpx.TransportError:
+            if i == attempts - 1:
+                raise
+        count("fetch.retries")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 4.0)
+
+async def fetch_source_async(ac: httpx.AsyncClient, src: Source,
+                             limit: int = 100) -> Tuple[List[Dict], Optional[FeedState]]:
+    state = await asyncio.to_thread(get_feed_state, src.name)
+    resp = await _get_async(ac, src.url, _cond_headers(state))
+    # feedparser/trafilatura/SQLite — в поток, чтобы другие загрузки шли дальше
+    return await asyncio.to_thread(_items_from_response, src, resp, state, limit)
+
+async def fetch_sources_async(
+    sources: List[Source],
+    per_source_s: float = FETCH_SOURCE_S,
+    deadline_s: float = FETCH_DEADLINE_S,
+    concurrency: int = FETCH_CONCURRENCY,
+    ac: Optional[httpx.AsyncClient] = None,
+) -> Dict[str, Union[Tuple[List[Dict], Optional[FeedState]], BaseException]]:
+    """
+    Качает все источники параллельно. Возвращает {source.name: (items, состояние ленты) | исключение}.
+    Источники, не успевшие к общему дедлайну, получают asyncio.TimeoutError.
+    """
+    own = ac is None
+    if own:
+        ac = httpx.AsyncClient(
+            timeout=per_source_s, headers=HEADERS, transport=_transport,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(src: Source):
+        async with sem:
+            with span("fetch.source"):
+                return await asyncio.wait_for(fetch_source_async(ac, src), per_source_s)
+
+    out: Dict[str, Union[Tuple[List[Dict], Optional[FeedState]], BaseException]] = {}
+    try:
+        tasks = {asyncio.create_task(one(s)): s for s in sources}
+        if not tasks:
+            return out
+        done, pending = await asyncio.wait(tasks, timeout=deadline_s)
+        for t in pending:
+            t.cancel()
+            out[tasks[t].name] = asyncio.TimeoutError("global deadline")
+        # дождаться отмены до aclose(): иначе запросы обрываются на закрытом клиенте
+        await asyncio.gather(*pending, return_exceptions=True)
+        for t in done:
+            out[tasks[t].name] = t.exception() or t.result()
+        count("fetch.deadline_miss", len(pending))
+        count("fetch.errors", sum(1 for t in done if t.exception()))
+    finally:
+        if own:
+            await ac.aclose()
     return out
+
+async def fetch_all_async(sources: List[Source], **kw) -> Tuple[List[Dict], Dict[str, FeedState]]:
+    """(все статьи, {source.name: новое состояние}) — состояния сохранять после upsert_articles."""
+    out: List[Dict] = []
+    states: Dict[str, FeedState] = {}
+    for name, res in (await fetch_sources_async(sources, **kw)).items():
+        # не валим пайплайн из-за одного источника
+        if not isinstance(res, BaseException):
+            out.extend(res[0])
+            if res[1]:
+                states[name] = res[1]
+    return out, states
+
+@timed("fetch_all")
+def fetch_all(sources: List[Source]) -> Tuple[List[Dict], Dict[str, FeedState]]:
+    # время сбора ограничено самым медленным источником (и FETCH_DEADLINE_S), а не суммой
+    return run_sync(fetch_all_async(sources))
@@ -0,0 +1,292 @@
+"""
+Приближённый поиск соседей по векторам статей: IVF над memory-mapped NumPy.
+
+Файлы в data/ann/<метка модели>/:
+  vecs.f16          — float16-матрица n×dim, дописывается в конец, перезаписанные векторы — на месте (np.memmap)
+  ids.i64, ts.i64   — article_id и published_ts строк
+  lists.<gen>.i32   — номер IVF-списка каждой строки, centroids.<gen>.npy — центроиды
+  meta.json         — n, dim, gen, last_id, last_seq; пишется последним (os.replace), поэтому
+                      читатель никогда не видит недописанные строки.
+
+Пока строк меньше ANN_TRAIN_MIN — точный перебор. Дальше — сферический k-means по выборке
+(≈4·√n списков) и переобучение, когда строк стало в ANN_RETRAIN_GROWTH раз больше.
+Вставки инкрементальные: sync() дочитывает из embeddings только новые статьи
+(векторы остаются в основной БД и после архивации, поэтому индекс покрывает всю историю),
+а перезаписанные векторы (embeddings.seq > last_seq из meta.json) обновляет на их же местах.
+
+Пересобрать/дописать вручную:  python -m app.nlp.ann
+"""
+import os, re, json, threading
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.storage.db import get_db, attach_archive
+from app.storage.vectors import VEC_DTYPE, load_vectors, rewritten_since
+from app.nlp.embeddings import EMBED_TAG
+
+try:
+    import fcntl
+except ImportError:  # не POSIX — один писатель (ingestor) и так
+    fcntl = None
+
+ANN_DIR = os.path.join(os.getcwd(), "data", "ann")
+ANN_TRAIN_MIN = 20000     # меньше строк — точный перебор быстрее любого обучения
+ANN_RETRAIN_GROWTH = 4    # центроиды переобучаются при росте индекса в 4 раза
+ANN_NPROBE = 8            # сколько ближайших списков просматривать
+_SAMPLE = 50000           # выборка для k-means
+_CHUNK = 65536            # строк за раз при переборе memmap
+
+
+def _slug(tag: str) -> str:
+    return re.sub(r"[^\w.@+-]+", "_", tag)
+
+def _normalize(X):
+    n = np.linalg.norm(X, axis=1, keepdims=True)
+    n[n == 0] = 1.0
+    return X / n
+
+def _nearest(X, C):
+    """Номер ближайшего центроида для каждой строки (по кускам — не держим n×nlist в памяти)."""
+    return np.concatenate([np.argmax(X[i:i+8192] @ C.T, axis=1) for i in range(0, len(X), 8192)]).astype(np.int32)
+
+def _kmeans(X, k, iters=10, seed=0):
+    """Сферический k-means: косинус, центроиды нормированы, пустые списки пересеваются."""
+    rng = np.random.default_rng(seed)
+    C = X[rng.choice(len(X), k, replace=False)].copy()
+    for _ in range(iters):
+        a = _nearest(X, C)
+        counts = np.bincount(a, minlength=k)
+        o = np.argsort(a, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nz = counts > 0
+        C[nz] = np.add.reduceat(X[o], starts[nz], axis=0)
+        C[~nz] = X[rng.choice(len(X), int((~nz).sum()), replace=False)]
+        C = _normalize(C)
+    return C.astype(np.float32)
+
+
+class AnnIndex:
+    def __init__(self, tag: str = EMBED_TAG, root: Optional[str] = None):
+        self.tag = tag
+        self.path = os.path.join(root or ANN_DIR, _slug(tag))
+        self.meta = {"n": 0, "dim": 0, "gen": 0, "trained_n": 0, "last_id": 0, "last_seq": 0}
+        self.vecs = self.ids = self.ts = self.lists = self.centroids = None
+        self._order = self._starts = None
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def _f(self, name):
+        return os.path.join(self.path, name)
+
+    @property
+    def n(self) -> int:
+        return self.meta["n"]
+
+    def refresh(self) -> "AnnIndex":
+        """Перечитывает индекс, если meta.json переписал писатель (обычно — процесс ingestor'а)."""
+        try:
+            st = os.stat(self._f("meta.json"))
+        except FileNotFoundError:
+            return self
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stamp == self._stamp:
+            return self
+        with self._lock:
+            if stamp == self._stamp:
+                return self
+            with open(self._f("meta.json")) as f:
+                meta = json.load(f)
+            n, d, g = meta["n"], meta["dim"], meta["gen"]
+            vecs = ids = ts = lists = cents = order = starts = None
+            if n:
+                vecs = np.memmap(self._f("vecs.f16"), dtype=VEC_DTYPE, mode="r", shape=(n, d))
+                ids = np.memmap(self._f("ids.i64"), dtype=np.int64, mode="r", shape=(n,))
+                ts = np.memmap(self._f("ts.i64"), dtype=np.int64, mode="r", shape=(n,))
+                if g:
+                    cents = np.load(self._f(f"centroids.{g}.npy"))
+                    lists = np.memmap(self._f(f"lists.{g}.i32"), dtype=np.int32, mode="r", shape=(n,))
+                    # инвертированные списки: строки, отсортированные по номеру списка, + границы
+                    order = np.argsort(lists, kind="stable")
+                    starts = np.searchsorted(lists[order], np.arange(len(cents) + 1))
+            self.vecs, self.ids, self.ts, self.lists, self.centroids = vecs, ids, ts, lists, cents
+            self._order, self._starts = order, starts
+            self.meta, self._stamp = meta, stamp
+        return self
+
+    def search(self, q, k: int = 10, nprobe: int = ANN_NPROBE,
+               before_ts: Optional[int] = None) -> List[Tuple[int, int, float]]:
+        """[(article_id, published_ts, косинус)] по убыванию сходства; before_ts — только более старые."""
+        self.refresh()
+        vecs, ids, ts, cents = self.vecs, self.ids, self.ts, self.centroids
+        order, starts, n = self._order, self._starts, self.n
+        if not n:
+            return []
+        q = np.asarray(q, dtype=np.float32).ravel()
+        if cents is None:
+            cand = np.arange(n)
+            sims = np.concatenate([vecs[i:i+_CHUNK].astype(np.float32) @ q for i in range(0, n, _CHUNK)])
+        else:
+            probe = np.argsort(-(cents @ q))[:nprobe]
+            cand = np.sort(np.concatenate([order[starts[c]:starts[c+1]] for c in probe]))  # чтение memmap по порядку
+            sims = vecs[cand].astype(np.float32) @ q
+        if before_ts is not None:
+            keep = np.asarray(ts[cand]) < before_ts
+            cand, sims = cand[keep], sims[keep]
+        if len(cand) > k:
+            top = np.argpartition(-sims, k)[:k]
+        else:
+            top = np.arange(len(cand))
+        top = top[np.argsort(-sims[top])]
+        return [(int(ids[cand[i]]), int(ts[cand[i]]), float(sims[i])) for i in top]
+
+    # ---- запись (один писатель: index_pending в процессе ingestor'а) ----
+
+    @contextmanager
+    def _writer(self):
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._f("lock"), "w") as lf:
+            if fcntl is not None:
+                fcntl.flock(lf, fcntl.LOCK_EX)
+            self._stamp = None
+            self.refresh()
+            yield dict(self.meta)
+
+    def _save_meta(self, meta):
+        tmp = self._f("meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._f("meta.json"))
+
+    def _truncate(self, meta):
+        # строки, дописанные после последнего meta.json (сбой посреди sync), отбрасываем
+        n, d, g = meta["n"], meta["dim"], meta["gen"]
+        files = [("vecs.f16", n * d * 2), ("ids.i64", n * 8), ("ts.i64", n * 8)]
+        if g:
+            files.append((f"lists.{g}.i32", n * 4))
+        for name, size in files:
+            with open(self._f(name), "ab") as f:
+                if f.tell() > size:
+                    f.truncate(size)
+
+    def _append(self, meta, ids, ts, V):
+        with open(self._f("vecs.f16"), "ab") as f:
+            f.write(np.ascontiguousarray(V, dtype=VEC_DTYPE).tobytes())
+        with open(self._f("ids.i64"), "ab") as f:
+            f.write(np.asarray(ids, dtype=np.int64).tobytes())
+        with open(self._f("ts.i64"), "ab") as f:
+            f.write(np.asarray(ts, dtype=np.int64).tobytes())
+        if meta["gen"]:
+            with open(self._f(f"lists.{meta['gen']}.i32"), "ab") as f:
+                f.write(_nearest(V.astype(np.float32), self.centroids).tobytes())
+        meta["n"] += len(ids)
+
+    def _rewrite(self, meta, ids) -> int:
+        """Векторы, перезаписанные в БД, — на их же строки в vecs.f16 (и в текущие списки IVF)."""
+        n, d = meta["n"], meta["dim"]
+        all_ids = np.memmap(self._f("ids.i64"), dtype=np.int64, mode="r", shape=(n,))
+        pos = np.nonzero(np.isin(all_ids, np.asarray(ids, dtype=np.int64)))[0]
+        got = load_vectors(all_ids[pos].tolist(), self.tag)
+        pos = [int(p) for p in pos if int(all_ids[p]) in got]
+        if not pos:
+            return 0
+        V = np.vstack([got[int(all_ids[p])] for p in pos])
+        with open(self._f("vecs.f16"), "r+b") as f:
+            for p, v in zip(pos, V):
+                f.seek(p * d * 2)
+                f.write(v.astype(VEC_DTYPE).tobytes())
+        if meta["gen"]:
+            with open(self._f(f"lists.{meta['gen']}.i32"), "r+b") as f:
+                for p, c in zip(pos, _nearest(V, self.centroids)):
+                    f.seek(p * 4)
+                    f.write(c.tobytes())
+        return len(pos)
+
+    def _train(self, meta):
+        n, d, g = meta["n"], meta["dim"], meta["gen"] + 1
+        vecs = np.memmap(self._f("vecs.f16"), dtype=VEC_DTYPE, mode="r", shape=(n, d))
+        rng = np.random.default_rng(n)
+        sample = np.sort(rng.choice(n, min(n, _SAMPLE), replace=False))
+        k = int(np.clip(4 * np.sqrt(n), 16, len(sample) // 39))
+        C = _kmeans(_normalize(vecs[sample].astype(np.float32)), k)
+        np.save(self._f(f"centroids.{g}.npy"), C)
+        with open(self._f(f"lists.{g}.i32"), "wb") as f:
+            for i in range(0, n, _CHUNK):
+                f.write(_nearest(vecs[i:i+_CHUNK].astype(np.float32), C).tobytes())
+        self.centroids = C
+        meta["gen"], meta["trained_n"] = g, n
+
+    def sync(self, batch: int = 5000) -> int:
+        """
+        Дописывает векторы, появившиеся в embeddings после прошлого sync, и обновляет перезаписанные.
+        Возвращает число дописанных и обновлённых строк.
+        """
+        added = 0
+        with self._writer() as meta:
+            self._truncate(meta)
+            old_gen = meta["gen"]
+            have = set(np.asarray(self.ids[self.ids > meta["last_id"]]).tolist()) if self.n else set()
+            with get_db() as conn:
+                arc = attach_archive(conn, create=False)
+                ts_sql = ("COALESCE(a.published_ts, (SELECT published_ts FROM arc.articles_archive WHERE id=e.article_id))"
+                          if arc else "a.published_ts")
+                # водяной знак: всё, что ≤ last_id, уже в индексе; статьи без вектора его не пропускают
+                pend = conn.execute("""
+                SELECT MIN(a.id) FROM articles a LEFT JOIN embeddings e ON e.article_id=a.id AND e.model=?
+                WHERE e.article_id IS NULL
+                """, (self.tag,)).fetchone()[0]
+                cursor, hi = meta["last_id"], meta["last_id"]
+                while True:
+                    rows = conn.execute(f"""
+                    SELECT e.article_id, {ts_sql}, e.vec FROM embeddings e
+                    LEFT JOIN articles a ON a.id=e.article_id
+                    WHERE e.model=? AND e.article_id>? ORDER BY e.article_id LIMIT ?
+                    """, (self.tag, cursor, batch)).fetchall()
+                    if not rows:
+                        break
+                    cursor = hi = rows[-1][0]
+                    rows = [r for r in rows if r[0] not in have]
+                    if not rows:
+                        continue
+                    V = np.vstack([np.frombuffer(r[2], dtype=VEC_DTYPE) for r in rows])
+                    meta["dim"] = meta["dim"] or V.shape[1]
+                    self._append(meta, [r[0] for r in rows], [r[1] or 0 for r in rows], V)
+                    added += len(rows)
+            meta["last_id"] = max(meta["last_id"], hi if pend is None else min(hi, pend - 1))
+            # после дописывания: строку, перезаписанную пока шёл проход по id, тоже поправим
+            upd, meta["last_seq"] = rewritten_since(self.tag, meta.get("last_seq", 0))
+            if upd and meta["n"]:
+                added += self._rewrite(meta, upd)
+            if meta["n"] >= ANN_TRAIN_MIN and meta["n"] >= meta["trained_n"] * ANN_RETRAIN_GROWTH:
+                self._train(meta)
+            self._save_meta(meta)
+            if meta["gen"] != old_gen and old_gen:
+                for name in (f"centroids.{old_gen}.npy", f"lists.{old_gen}.i32"):
+                    try:
+                        os.remove(self._f(name))
+                    except FileNotFoundError:
+                        pass
+        self._stamp = None
+        self.refresh()
+        return added
+
+
+_index: Optional[AnnIndex] = None
+
+def get_index() -> AnnIndex:
+    """Индекс текущей модели (EMBED_TAG), один на процесс."""
+    global _index
+    if _index is None:
+        _index = AnnIndex()
+    return _index.refresh()
+
+def sync_index() -> int:
+    return get_index().sync()
+
+
+if __name__ == "__main__":
+    from app.storage.db import init_db
+    init_db()
+    idx = get_index()
+    print(json.dumps({"added": idx.sync(), **idx.meta}, ensure_ascii=False))
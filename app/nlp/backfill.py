@@ -0,0 +1,162 @@
+"""
+Бэкфилл векторов по всей истории (горячая БД + архив): новый источник, смена модели/бэкенда.
+
+    python -m app.nlp.backfill [--workers=N] [--threads=T] [--batch=B] [--chunk=C] [--backend=torch|onnx] [--restart]
+
+Статьи читаются из SQLite кусками по id (chunk), куски кодируются в пуле процессов
+(spawn; у каждого своя модель и T потоков torch — N×T ≈ число ядер, без переподписки),
+в работе одновременно не больше 2·N кусков — память ограничена. Векторы пишутся пачкой
+вместе с контрольной точкой (backfill_state) в одной транзакции и строго по порядку id,
+поэтому прерванный бэкфилл продолжается с места остановки; --restart — пройти заново.
+Векторы хранятся по (статья, модель) (миграция 7): бэкфилл другого бэкенда, например
+--backend=onnx рядом с ботом на torch, пишет свои строки и не трогает векторы, с которыми работает бот.
+Для модели текущего бэкенда после векторов дописывается ANN-индекс и раскладываются сюжеты.
+"""
+import os, sys, json, time, logging
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from app.core.config import EMBED_BACKEND
+from app.storage.db import get_db, attach_archive, init_db
+from app.storage.vectors import save_vectors, VEC_DTYPE
+from app.storage.retention import unpack
+from app.nlp.embeddings import BACKENDS, embed_tag, article_text
+
+log = logging.getLogger("radar.backfill")
+
+BATCH = 64    # текстов в одном forward (как в app.bench.embeddings)
+CHUNK = 1024  # статей в одной задаче пула и в одной транзакции записи
+
+
+def default_workers() -> int:
+    return max(1, min(4, (os.cpu_count() or 1) // 2))
+
+def default_threads(workers: int) -> int:
+    return max(1, (os.cpu_count() or 1) // workers)
+
+# ---------------------------- процесс пула ----------------------------
+
+_backend = EMBED_BACKEND
+
+def _init_worker(backend, threads):
+    global _backend
+    _backend = backend
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"  # токенизатор не плодит свои потоки поверх наших
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        torch.set_num_interop_threads(1)
+    except (ImportError, RuntimeError):
+        pass
+    from app.nlp.embeddings import get_model
+    get_model(backend)  # модель грузится один раз на процесс, до первого куска
+
+def _encode(texts, batch):
+    from app.nlp.embeddings import embed_texts
+    return np.asarray(embed_texts(texts, _backend, batch_size=batch), dtype=VEC_DTYPE)
+
+# ---------------------------- основной процесс ----------------------------
+
+def checkpoint(tag: str):
+    with get_db() as conn:
+        r = conn.execute("SELECT last_id, done, started_ts FROM backfill_state WHERE model=?", (tag,)).fetchone()
+    return r or (0, 0, None)
+
+def _save_checkpoint(conn, tag, last_id, done, started_ts):
+    conn.execute("""
+    INSERT OR REPLACE INTO backfill_state(model, last_id, done, started_ts, updated_ts) VALUES(?,?,?,?,?)
+    """, (tag, last_id, done, started_ts, int(time.time())))
+
+def _chunks(tag: str, after: int, size: int):
+    """[(id, текст)] статей без вектора tag с id > after — кусками по возрастанию id, с архивом."""
+    while True:
+        with get_db() as conn:
+            arc = attach_archive(conn, create=False)
+            hot = """
+            SELECT a.id, a.title, a.summary, NULL FROM main.articles a
+            LEFT JOIN embeddings e ON e.article_id=a.id AND e.model=?
+            WHERE a.id>? AND e.article_id IS NULL
+            """
+            old = """
+            SELECT x.id, x.title, x.summary_z, x.codec FROM arc.articles_archive x
+            LEFT JOIN embeddings e ON e.article_id=x.id AND e.model=?
+            WHERE x.id>? AND e.article_id IS NULL
+            """
+            sql = f"{hot} UNION ALL {old}" if arc else hot
+            params = (tag, after, tag, after) if arc else (tag, after)
+            rows = conn.execute(f"{sql} ORDER BY 1 LIMIT ?", (*params, size)).fetchall()
+        if not rows:
+            return
+        yield [(aid, article_text(title, summary if codec is None else unpack(summary, codec)))
+               for aid, title, summary, codec in rows]
+        after = rows[-1][0]
+
+def backfill(backend: str = EMBED_BACKEND, workers: int = 0, threads: int = 0,
+             batch: int = BATCH, chunk: int = CHUNK, restart: bool = False) -> dict:
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown embedding backend {backend!r}, expected one of {BACKENDS}")
+    tag = embed_tag(backend)
+    workers = workers or default_workers()
+    threads = threads or default_threads(workers)
+    if restart:
+        with get_db() as conn:
+            conn.execute("DELETE FROM backfill_state WHERE model=?", (tag,))
+    last_id, done, started = checkpoint(tag)
+    resumed_from, done0 = last_id, done
+    started = started or int(time.time())
+    t0 = time.perf_counter()
+
+    def write(ids, vecs):
+        nonlocal last_id, done
+        with get_db() as conn:  # векторы и контрольная точка — одной транзакцией
+            save_vectors(ids, vecs, tag)
+            last_id, done = ids[-1], done + len(ids)
+            _save_checkpoint(conn, tag, last_id, done, started)
+        rate = (done - done0) / max(time.perf_counter() - t0, 1e-9)
+        log.info("backfill %s: %d статей (до id %d), %.1f статей/с", tag, done, last_id, rate)
+
+    inflight = deque()
+    with ProcessPoolExecutor(workers, mp_context=mp.get_context("spawn"),
+                             initializer=_init_worker, initargs=(backend, threads)) as ex:
+        for part in _chunks(tag, last_id, chunk):
+            ids = [aid for aid, _ in part]
+            inflight.append((ids, ex.submit(_encode, [t for _, t in part], batch)))
+            # запись — по порядку подачи: контрольная точка не перепрыгивает незаписанные куски
+            while len(inflight) >= 2 * workers:
+                ids, fut = inflight.popleft()
+                write(ids, fut.result())
+        while inflight:
+            ids, fut = inflight.popleft()
+            write(ids, fut.result())
+    embed_s = time.perf_counter() - t0
+
+    report = {
+        "model": tag, "workers": workers, "threads": threads, "batch": batch, "chunk": chunk,
+        "resumed_from_id": resumed_from, "embedded": done - done0, "total_done": done,
+        "embed_s": round(embed_s, 1), "articles_per_s": round((done - done0) / max(embed_s, 1e-9), 1),
+    }
+    if backend == EMBED_BACKEND:
+        from app.nlp.ann import sync_index
+        from app.nlp.stories import assign_pending
+        t1 = time.perf_counter()
+        report["ann_added"] = sync_index()
+        report["assigned"] = assign_pending()
+        report["index_s"] = round(time.perf_counter() - t1, 1)
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    opts = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    init_db()
+    print(json.dumps(backfill(
+        backend=opts.get("backend", EMBED_BACKEND),
+        workers=int(opts.get("workers", 0)), threads=int(opts.get("threads", 0)),
+        batch=int(opts.get("batch", BATCH)), chunk=int(opts.get("chunk", CHUNK)),
+        restart="--restart" in sys.argv[1:],
+    ), ensure_ascii=False, indent=2))
@@ -1,19 +1,105 @@
+"""
+e5-эмбеддинги статей.
+
+sentence_transformers (torch) импортируется лениво — при первой загрузке модели,
+поэтому импорт пайплайна и старт бота не ждут их. model_ready() — сигнал готовности:
+пока модель не загружена, бот отвечает по уже сохранённым векторам (build_events(embed=False)).
+"""
+import os, time, threading, logging
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.cluster import DBSCAN
-
-_model=None
-def get_model():
-    global _model
-    if _model is None:
-        _model=SentenceTransformer("intfloat/multilingual-e5-small")
-    return _model
-
-def embed_texts(texts):
-    m=get_model()
-    return np.asarray(m.encode([t[:512] for t in texts], normalize_embeddings=True))
-
-def cluster_texts(embeds, eps=0.25, min_samples=2):
-    db=DBSCAN(eps=eps, min_samples=min_samples, metric="cosine")
-    labels=db.fit_predict(embeds)
-    return labels
+
+from app.core.config import EMBED_BACKEND, ONNX_QCONFIG, MODEL_DIR
+from app.storage.vectors import load_vectors, save_vectors, pending_articles, VEC_DTYPE
+from app.core.profiler import span, count
+
+MODEL_NAME = "intfloat/multilingual-e5-small"
+BACKENDS = ("torch", "onnx")
+
+def embed_tag(backend=EMBED_BACKEND):
+    """
+    Метка версии векторов: смена модели/препроцессинга → старые векторы не используются.
+    int8-векторы близки к torch, но не равны им — храним отдельно, чтобы не смешивать в сюжетах.
+    """
+    return f"{MODEL_NAME}@v1" if backend == "torch" else f"{MODEL_NAME}+{backend}-int8@v1"
+
+EMBED_TAG = embed_tag()
+
+def _load_onnx():
+    """ONNX Runtime + динамическое int8-квантование; экспорт — один раз в MODEL_DIR."""
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+    path = os.path.join(MODEL_DIR, MODEL_NAME.split("/")[-1] + "-onnx")
+    qfile = f"onnx/model_qint8_{ONNX_QCONFIG}.onnx"
+    if not os.path.exists(os.path.join(path, qfile)):
+        m = SentenceTransformer(MODEL_NAME, backend="onnx")  # fp32-экспорт через optimum
+        m.save_pretrained(path)
+        export_dynamic_quantized_onnx_model(m, ONNX_QCONFIG, path)
+    return SentenceTransformer(path, backend="onnx", model_kwargs={"file_name": qfile})
+
+_models={}
+_lock=threading.Lock()   # прогрев в фоне и первый запрос не должны грузить модель дважды
+_ready=threading.Event()
+
+def get_model(backend=EMBED_BACKEND):
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown embedding backend {backend!r}, expected one of {BACKENDS}")
+    if backend not in _models:
+        with _lock:
+            if backend not in _models:
+                if backend == "torch":
+                    from sentence_transformers import SentenceTransformer
+                    _models[backend] = SentenceTransformer(MODEL_NAME)
+                else:
+                    _models[backend] = _load_onnx()
+    return _models[backend]
+
+def model_ready() -> bool:
+    """Модель текущего бэкенда загружена и прогрета — эмбеддинг не упрётся в холодный старт."""
+    return _ready.is_set()
+
+def warm_up() -> float:
+    """Загрузка и пробный encode (первый прогон ONNX/torch заметно медленнее). Возвращает секунды."""
+    t0 = time.perf_counter()
+    embed_texts(["прогрев модели"])
+    dt = time.perf_counter() - t0
+    logging.getLogger("radar.embed").info("embedding model %s ready in %.1fs", EMBED_TAG, dt)
+    return dt
+
+def article_text(title, summary):
+    return (title or "") + " " + (summary or "")
+
+def embed_texts(texts, backend=EMBED_BACKEND, batch_size=32):
+    with span("embed.load"):
+        m=get_model(backend)
+    with span("embed.encode"):
+        out=np.asarray(m.encode([t[:512] for t in texts], batch_size=batch_size, normalize_embeddings=True))
+    count("embed.texts", len(texts))
+    if backend == EMBED_BACKEND:
+        _ready.set()
+    return out
+
+def ensure_embeddings(ids, texts):
+    """
+    Матрица векторов для статей (в порядке ids): берём из SQLite,
+    модель запускаем только для тех, у кого вектора ещё нет, и сразу сохраняем.
+    """
+    got = load_vectors(ids, EMBED_TAG)
+    miss = [i for i, aid in enumerate(ids) if aid not in got]
+    count("embed.stored_hit", len(ids) - len(miss))
+    if miss:
+        fresh = embed_texts([texts[i] for i in miss])
+        save_vectors([ids[i] for i in miss], fresh, EMBED_TAG)
+        for i, v in zip(miss, fresh):
+            got[ids[i]] = np.asarray(v, dtype=VEC_DTYPE).astype(np.float32)  # как после чтения из БД
+    if not ids:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.vstack([got[aid] for aid in ids])
+
+def embed_pending(batch=256):
+    """Досчитать векторы новым статьям (вызывается ingestor'ом после upsert). Возвращает число статей."""
+    done = 0
+    while True:
+        rows = pending_articles(EMBED_TAG, batch)
+        if not rows:
+            return done
+        save_vectors([r[0] for r in rows], embed_texts([article_text(r[1], r[2]) for r in rows]), EMBED_TAG)
+        done += len(rows)
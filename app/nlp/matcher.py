@@ -0,0 +1,201 @@
+"""
+Единый матчер тикеров/тем/релевантности.
+
+Все словари (COMPANY_MAP, TOPIC_MAP, MARKET_WORDS, KNOWN_TICKERS) компилируются
+один раз при импорте. Текст понижается и просматривается один раз на все литералы
+(ключевые слова тем и релевантности + обязательные «якоря» регулярок компаний);
+регулярка компании запускается, только если её якорь в тексте есть.
+Результат совпадает с extract_secids / company_secids / infer_targets / relevance_score.
+
+Если установлен pyahocorasick — литералы ищутся автоматом Ахо–Корасик за один проход.
+"""
+import re, json
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.nlp.topics import COMPANY_MAP, TOPIC_MAP, MARKET_WORDS
+from app.nlp.entities import KNOWN_TICKERS, UPPER_RE
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+def _split_top(pat: str) -> List[str]:
+    """Ветки альтернативы верхнего уровня: 'a|b(c|d)' -> ['a', 'b(c|d)']."""
+    parts, cur, depth, i = [], "", 0, 0
+    while i < len(pat):
+        ch = pat[i]
+        if ch == "\\":
+            cur += pat[i:i+2]; i += 2; continue
+        if ch in "([":
+            depth += 1
+        elif ch in ")]":
+            depth -= 1
+        if ch == "|" and depth == 0:
+            parts.append(cur); cur = ""
+        else:
+            cur += ch
+        i += 1
+    parts.append(cur)
+    return parts
+
+def _anchor(branch: str) -> str:
+    """Самый длинный обязательный литерал ветки ('' — если выделить не удалось)."""
+    runs, i = [""], 0
+    while i < len(branch):
+        ch = branch[i]
+        if ch == "\\":
+            if branch[i+1:i+2] != "b":       # \b нулевой ширины — литерал не рвёт
+                runs.append("")
+            i += 2; continue
+        if ch in "[(":
+            close = "]" if ch == "[" else ")"
+            j = branch.find(close, i)
+            i = len(branch) if j < 0 else j + 1
+            runs.append(""); continue
+        if ch in "?*{":                       # предыдущий символ необязателен
+            runs[-1] = runs[-1][:-1]
+            if ch == "{":
+                j = branch.find("}", i); i = len(branch) if j < 0 else j
+            runs.append(""); i += 1; continue
+        if ch in "+.^$)]":
+            runs.append(""); i += 1; continue
+        runs[-1] += ch; i += 1
+    return max(runs, key=len)
+
+
+@dataclass
+class Matches:
+    companies: List[str] = field(default_factory=list)  # SECID по синонимам (порядок COMPANY_MAP)
+    tickers: List[str] = field(default_factory=list)    # UPPERCASE-тикеры из KNOWN_TICKERS (порядок текста)
+    targets: List[str] = field(default_factory=list)    # SECID первой подходящей темы TOPIC_MAP
+    market: List[str] = field(default_factory=list)     # найденные MARKET_WORDS
+    topic: Optional[int] = None                         # индекс темы в TOPIC_MAP (для слияния)
+
+    @property
+    def secids(self) -> List[str]:
+        """= extract_secids: синонимы, затем явные тикеры, максимум 4."""
+        out, seen = [], set()
+        for s in self.companies + self.tickers:
+            if s and s not in seen:
+                out.append(s); seen.add(s)
+        return out[:4]
+
+    @property
+    def relevance(self) -> float:
+        """= relevance_score."""
+        return min(1.0, len(self.market)/3.0)
+
+    @property
+    def all_secids(self) -> List[str]:
+        """Все SECID без лимита — для обратного индекса article_secids."""
+        return list(dict.fromkeys(s for s in self.companies + self.tickers if s))
+
+    def to_json(self) -> Dict:
+        return {"companies": self.companies, "tickers": self.tickers,
+                "topic": self.topic, "market": self.market}
+
+    @classmethod
+    def from_json(cls, d: Dict) -> "Matches":
+        m = cls(list(d.get("companies") or []), list(d.get("tickers") or []), [],
+                list(d.get("market") or []), d.get("topic"))
+        if m.topic is not None:
+            m.targets = list(MATCHER.topics[m.topic][1])
+        return m
+
+    @classmethod
+    def merge(cls, items: Iterable["Matches"]) -> "Matches":
+        """
+        Матчи склеенного текста по матчам его частей (в том же порядке):
+        компании — в порядке COMPANY_MAP, тикеры — в порядке частей, тема — первая по TOPIC_MAP.
+        """
+        m = cls()
+        comp, market = set(), set()
+        for it in items:
+            comp.update(it.companies)
+            for t in it.tickers:
+                if t not in m.tickers:
+                    m.tickers.append(t)
+            market.update(it.market)
+            if it.topic is not None and (m.topic is None or it.topic < m.topic):
+                m.topic = it.topic
+        m.companies = sorted(comp, key=lambda s: MATCHER.company_order.get(s, 1 << 30))
+        m.market = [k for k in MARKET_WORDS if k in market]
+        if m.topic is not None:
+            m.targets = list(MATCHER.topics[m.topic][1])
+        return m
+
+
+class Matcher:
+    def __init__(self):
+        # (скомпилированная регулярка, якоря или None = проверять всегда, SECID)
+        self.companies: List[Tuple[re.Pattern, Optional[List[str]], List[str]]] = []
+        for pat, secids in COMPANY_MAP.items():
+            anchors = [_anchor(b).lower() for b in _split_top(pat)]
+            self.companies.append((re.compile(pat, re.I), anchors if all(anchors) else None, secids))
+        self.company_order: Dict[str, int] = {}
+        for secids in COMPANY_MAP.values():
+            for sec in secids:
+                self.company_order.setdefault(sec, len(self.company_order))
+        self.topics = [(list(keys), list(dict.fromkeys(secids))) for keys, secids in TOPIC_MAP]
+        self.literals = sorted(
+            {a for _, anchors, _ in self.companies for a in (anchors or [])}
+            | {k for keys, _ in self.topics for k in keys}
+            | set(MARKET_WORDS)
+        )
+        self._ac = None
+        if ahocorasick is not None:
+            self._ac = ahocorasick.Automaton()
+            for k in self.literals:
+                self._ac.add_word(k, k)
+            self._ac.make_automaton()
+
+    def _present(self, low: str) -> set:
+        if self._ac is not None:
+            return {k for _, k in self._ac.iter(low)}
+        return {k for k in self.literals if k in low}
+
+    def match(self, text: str) -> Matches:
+        t = text or ""
+        low = t.lower()
+        hit = self._present(low)
+        m = Matches()
+        seen = set()
+        for rx, anchors, secids in self.companies:
+            if anchors is not None and not any(a in hit for a in anchors):
+                continue
+            if rx.search(low):
+                for s in secids:
+                    if s and s not in seen:
+                        m.companies.append(s); seen.add(s)
+        for token in UPPER_RE.findall(t):
+            if token in KNOWN_TICKERS and token not in m.tickers:
+                m.tickers.append(token)
+        for i, (keys, secids) in enumerate(self.topics):
+            if any(k in hit for k in keys):
+                m.targets, m.topic = list(secids), i
+                break
+        m.market = [k for k in MARKET_WORDS if k in hit]
+        return m
+
+
+MATCHER = Matcher()
+
+def match_text(text: str) -> Matches:
+    return MATCHER.match(text)
+
+def stored_matches(entities: Optional[str], text: str) -> Matches:
+    """Сущности, сохранённые при сборе (articles.entities); для старых строк — досчитываем по тексту."""
+    if entities and entities.startswith("{"):
+        return Matches.from_json(json.loads(entities))
+    return match_text(text)
+
+def resolve_secid(text: str) -> Optional[str]:
+    """Тикер для подписки: явный SECID из словарей или первая компания/тикер, найденные в тексте."""
+    t = (text or "").strip()
+    if t.upper() in KNOWN_TICKERS or t.upper() in MATCHER.company_order:
+        return t.upper()
+    m = match_text(t)
+    return (m.companies or m.tickers or [None])[0]
@@ -0,0 +1,142 @@
+"""
+Инкрементальная кластеризация в сюжеты.
+
+Каждая новая статья (с вектором) либо присоединяется к ближайшему по центроиду
+недавнему сюжету, либо открывает новый. Сюжеты и членство живут в SQLite,
+поэтому build_events читает готовые кластеры, а dedup_group стабилен между вызовами.
+
+Если недавнего сюжета нет, ANN-индекс (app.nlp.ann) ищет очень близкую статью
+старше окна: сюжет, который всплыл снова, продолжается под прежним id.
+"""
+from typing import Dict, Iterable, List
+import numpy as np
+
+from app.storage.db import get_db
+from app.storage.vectors import VEC_DTYPE
+from app.storage.ingest import articles_meta
+from app.nlp.embeddings import EMBED_TAG, embed_texts
+from app.nlp.ann import get_index
+
+STORY_SIM = 0.75        # косинус для присоединения (= 1 - eps прежнего DBSCAN)
+STORY_LOOKBACK_H = 72   # с сюжетами старше этого новая статья не сравнивается
+STORY_LINK_SIM = 0.85   # статья ↔ статья старше окна: порог строже, чтобы не склеивать однотипные новости
+_CHUNK = 900
+
+def _unit(v):
+    n = float(np.linalg.norm(v))
+    return v / n if n else v
+
+def _older_story(conn, ann, v, ts):
+    """(story_id, sim) сюжета самой похожей статьи старше окна или None."""
+    for aid, _, sim in ann.search(v, k=5, before_ts=ts - STORY_LOOKBACK_H*3600):
+        if sim < STORY_LINK_SIM:
+            return None
+        row = conn.execute("SELECT story_id FROM story_members WHERE article_id=?", (aid,)).fetchone()
+        if row:
+            return row[0], sim
+    return None
+
+def assign_pending(batch: int = 512) -> int:
+    """Раскладывает статьи с вектором, но без сюжета. Возвращает число обработанных статей."""
+    done = 0
+    while True:
+        with get_db() as conn:
+            # раскладывают и ingestor (процесс-воркер), и запросы бота: без блокировки записи на всю пачку
+            # два прохода читают одних и тех же «ничьих» статей и одни центроиды и затирают друг друга
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("""
+            SELECT a.id, a.published_ts, e.vec FROM articles a
+            JOIN embeddings e ON e.article_id=a.id AND e.model=?
+            LEFT JOIN story_members m ON m.article_id=a.id
+            WHERE m.article_id IS NULL ORDER BY a.published_ts, a.id LIMIT ?
+            """, (EMBED_TAG, batch)).fetchall()
+            if not rows:
+                return done
+            since = min(r[1] for r in rows) - STORY_LOOKBACK_H*3600
+            st = conn.execute(
+                "SELECT id, centroid, n, first_ts, last_ts FROM stories WHERE model=? AND last_ts>=?",
+                (EMBED_TAG, since),
+            ).fetchall()
+            sids  = [r[0] for r in st]
+            cents = [np.frombuffer(r[1], dtype=VEC_DTYPE).astype(np.float32) for r in st]
+            n     = [r[2] for r in st]
+            first = [r[3] for r in st]
+            last  = [r[4] for r in st]
+            dirty = set()
+            C = np.vstack(cents) if cents else None
+            members = []
+            ann = get_index()
+            for aid, ts, blob in rows:
+                v = np.frombuffer(blob, dtype=VEC_DTYPE).astype(np.float32)
+                best, sim = -1, -1.0
+                if C is not None:
+                    sims = C @ v
+                    sims[np.asarray(last) < ts - STORY_LOOKBACK_H*3600] = -1.0
+                    best = int(np.argmax(sims)); sim = float(sims[best])
+                old = _older_story(conn, ann, v, ts) if sim < STORY_SIM and ann.n else None
+                if old is not None:
+                    # сюжет старше окна всплыл снова — подгружаем его и продолжаем
+                    if old[0] in sids:
+                        best = sids.index(old[0])
+                    else:
+                        o = conn.execute("SELECT centroid, n, first_ts, last_ts FROM stories WHERE id=?", (old[0],)).fetchone()
+                        c = np.frombuffer(o[0], dtype=VEC_DTYPE).astype(np.float32)
+                        sids.append(old[0]); n.append(o[1]); first.append(o[2]); last.append(o[3])
+                        C = c[None, :].copy() if C is None else np.vstack([C, c])
+                        best = len(sids) - 1
+                    sim = old[1]
+                if sim >= STORY_SIM:
+                    C[best] = _unit(C[best]*n[best] + v)
+                    n[best] += 1
+                    first[best] = min(first[best], ts); last[best] = max(last[best], ts)
+                    dirty.add(best)
+                else:
+                    cur = conn.execute(
+                        "INSERT INTO stories(model, centroid, n, first_ts, last_ts) VALUES(?,?,?,?,?)",
+                        (EMBED_TAG, v.astype(VEC_DTYPE).tobytes(), 1, ts, ts),
+                    )
+                    sids.append(cur.lastrowid); n.append(1); first.append(ts); last.append(ts)
+                    C = v[None, :].copy() if C is None else np.vstack([C, v])
+                    best, sim = len(sids) - 1, 1.0
+                members.append((aid, sids[best], round(sim, 4)))
+            conn.executemany(
+                "UPDATE stories SET centroid=?, n=?, first_ts=?, last_ts=?, dirty=dirty+1 WHERE id=?",
+                [(C[i].astype(VEC_DTYPE).tobytes(), n[i], first[i], last[i], sids[i]) for i in dirty],
+            )
+            conn.executemany("INSERT OR REPLACE INTO story_members(article_id, story_id, sim) VALUES(?,?,?)", members)
+        done += len(rows)
+
+def story_ids(article_ids: Iterable[int]) -> Dict[int, int]:
+    """{article_id: story_id} для уже разложенных статей."""
+    ids = list(article_ids); out: Dict[int, int] = {}
+    with get_db() as conn:
+        for i in range(0, len(ids), _CHUNK):
+            part = ids[i:i+_CHUNK]
+            out.update(conn.execute(
+                f"SELECT article_id, story_id FROM story_members WHERE article_id IN ({','.join('?'*len(part))})", part
+            ).fetchall())
+    return out
+
+def similar_stories(text: str, k: int = 5) -> List[Dict]:
+    """Похожие события за всю историю (включая архив): лучшая статья каждого сюжета, по убыванию сходства."""
+    hits = get_index().search(embed_texts([text])[0], k=max(50, 10*k))
+    sid_of = story_ids(h[0] for h in hits)
+    best: Dict[int, tuple] = {}
+    for aid, ts, sim in hits:
+        sid = sid_of.get(aid, -aid)
+        if sid not in best:
+            best[sid] = (aid, ts, sim)
+    top = sorted(best.items(), key=lambda kv: -kv[1][2])[:k]
+    meta = articles_meta(h[0] for _, h in top)
+    with get_db() as conn:
+        sizes = dict(conn.execute(
+            f"SELECT id, n FROM stories WHERE id IN ({','.join('?'*len(top))})", [sid for sid, _ in top]
+        ).fetchall()) if top else {}
+    out = []
+    for sid, (aid, ts, sim) in top:
+        m = meta.get(aid)
+        if m is None:
+            continue
+        out.append({"story_id": sid, "sim": round(sim, 3), "n": sizes.get(sid, 1), **m})
+    return out
@@ -1,5 +1,3 @@
-import re
-
 # ----------------------------- Компании (RU) -----------------------------
 COMPANY_MAP = {
     # Банки
@@ -70,34 +68,17 @@ MARKET_WORDS = [
 
 REL_MIN = 0.35  # порог отсечения «политшума» (кроме REG/EXCH)
 
-def _find_by_regex(text: str, table: dict):
-    t=(text or "").lower()
-    secids=[]
-    for pat, lst in table.items():
-        if re.search(pat, t, flags=re.I):
-            secids.extend(lst)
-    # уникализировать, сохранить порядок
-    seen=set(); out=[]
-    for s in secids:
-        if s and s not in seen:
-            out.append(s); seen.add(s)
-    return out
+# Сами проверки — в app.nlp.matcher (один скомпилированный проход по тексту).
+# Если нужно сразу несколько результатов по одному тексту — зовите match_text напрямую.
 
 def company_secids(text: str):
-    return _find_by_regex(text, COMPANY_MAP)
+    from app.nlp.matcher import match_text
+    return match_text(text).companies
 
 def infer_targets(text: str):
-    t = (text or "").lower()
-    for keys, secids in TOPIC_MAP:
-        if any(k in t for k in keys):
-            seen=set(); out=[]
-            for s in secids:
-                if s not in seen:
-                    out.append(s); seen.add(s)
-            return out
-    return []
+    from app.nlp.matcher import match_text
+    return match_text(text).targets
 
 def relevance_score(text: str) -> float:
-    t = (text or "").lower()
-    hits = sum(1 for k in MARKET_WORDS if k in t)
-    return min(1.0, hits/3.0)
+    from app.nlp.matcher import match_text
+    return match_text(text).relevance
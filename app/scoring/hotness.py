@@ -1,4 +1,7 @@
 import math, time
+from dataclasses import dataclass
+
+import numpy as np
 
 def recency_score(max_ts, now=None, half_life_h=6.0):
     now = now or time.time()
@@ -39,3 +42,81 @@ def combine_logistic(weights, feats):
         z += w * feats.get(k,0.0)
     # масштабируем (эмпирически): делим на 2.5 для мягкости
     return round(logistic(z/2.5), 3)
+
+
+# ---- Пакетный расчёт: все события окна одним векторизованным вызовом ----
+
+HALF_LIFE_H = 6.0
+VELOCITY_H = 3        # «последние часы» velocity_score
+# (признак, lo, hi) — те же шкалы norm_clip, что в пайплайне
+IMPACT_SCALES = {"price_move": (0.5, 6.0), "volume_ratio": (0.8, 3.0), "price_anomaly": (1.0, 4.0)}
+
+@dataclass
+class EventColumns:
+    """
+    Колоночное представление событий. Статьи всех событий идут подряд:
+    статьи события i — срез [offsets[i], offsets[i+1]) (последнее — до конца массивов).
+    Метрики влияния без данных — NaN.
+    """
+    offsets: np.ndarray        # начало статей каждого события, по возрастанию
+    ts: np.ndarray             # published_ts статей
+    cred: np.ndarray           # cred_weight статей
+    group: np.ndarray          # группа источника статьи (REG/EXCH/TIER1/...)
+    breadth: np.ndarray        # число различных SECID события
+    relevance: np.ndarray
+    pct_move: np.ndarray
+    volume_ratio: np.ndarray
+    price_anomaly: np.ndarray
+
+    def __len__(self):
+        return len(self.offsets)
+
+def norm_clip_batch(x, lo, hi):
+    """= norm_clip поэлементно; NaN (нет данных) → 0."""
+    return np.nan_to_num(np.clip((np.asarray(x, dtype=float) - lo)/(hi - lo), 0.0, 1.0), nan=0.0)
+
+def features_batch(cols: EventColumns, now=None):
+    """{признак: массив по событиям} — те же признаки, что recency_score/velocity_score/… по одному."""
+    now = now or time.time()
+    n = len(cols)
+    if n == 0:
+        return {}
+    starts = np.asarray(cols.offsets, dtype=np.int64)
+    counts = np.diff(np.append(starts, len(cols.ts)))
+    ev = np.repeat(np.arange(n), counts)        # номер события для каждой статьи
+    ts = np.asarray(cols.ts, dtype=float)
+    cred = np.asarray(cols.cred, dtype=float)
+
+    age_h = np.maximum(0.0, (now - np.maximum.reduceat(ts, starts))/3600.0)
+    recent = (now - ts >= 0) & (now - ts < VELOCITY_H*3600)
+    # top-3 весов внутри события: сортировка (событие, -вес) и ранг от начала события
+    o = np.lexsort((-cred, ev))
+    top3 = (np.arange(len(o)) - starts[ev[o]]) < 3
+    _, g = np.unique(np.asarray(cols.group), return_inverse=True)
+    kinds = np.bincount(np.unique(ev*(g.max() + 1) + g) // (g.max() + 1), minlength=n)
+
+    F = {
+        "recency":       np.exp(-math.log(2)*age_h/HALF_LIFE_H),
+        "velocity":      np.minimum(1.0, np.bincount(ev, weights=recent, minlength=n)/6.0),
+        "credibility":   np.minimum(1.0, np.bincount(ev[o][top3], weights=cred[o][top3], minlength=n)/3.0),
+        "confirmations": np.minimum(1.0, kinds/3.0),
+        "breadth":       np.minimum(1.0, np.asarray(cols.breadth, dtype=float)/4.0),
+        "relevance":     np.asarray(cols.relevance, dtype=float),
+    }
+    F["price_move"]    = norm_clip_batch(np.abs(np.asarray(cols.pct_move, dtype=float)), *IMPACT_SCALES["price_move"])
+    F["volume_ratio"]  = norm_clip_batch(cols.volume_ratio, *IMPACT_SCALES["volume_ratio"])
+    F["price_anomaly"] = norm_clip_batch(cols.price_anomaly, *IMPACT_SCALES["price_anomaly"])
+    return F
+
+def top_k_indices(hotness, validity, k):
+    """
+    Индексы k лучших по (hotness, validity) по убыванию — argpartition + сортировка только k,
+    а не всего окна. Обе величины округлены до 3 знаков, поэтому целочисленный ключ точен.
+    """
+    hotness, validity = np.asarray(hotness), np.asarray(validity)
+    n = len(hotness)
+    if n == 0 or k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    key = np.rint(hotness*1000).astype(np.int64)*2001 + np.rint(validity*1000).astype(np.int64)
+    idx = np.argpartition(-key, k - 1)[:k] if k < n else np.arange(n)
+    return idx[np.argsort(-key[idx], kind="stable")]
@@ -0,0 +1,186 @@
+"""
+Материализованные признаки сюжетов (колонки таблицы stories).
+
+Всё, что меняется только с новой статьёй в сюжете или новыми свечами, хранится в строке:
+статические признаки (credibility, confirmations, breadth, relevance, price_*),
+их вклад в логит (z_static) и в validity (v_static), secids и хвост последних published_ts.
+Время входит только через recency (last_ts) и velocity (tail) — это досчитывают
+SQL-функции hotness()/validity() при чтении, поэтому чтение — один запрос без пересчёта
+признаков: индекс (model, eligible, last_ts) отбирает сюжеты окна, а hotness() считается
+для каждого из них и сортирует уже SQLite (индекс сортировку не обслуживает — горячесть
+зависит от now). Цена — O(сюжетов окна) вызовов Python-функции, без чтения статей.
+
+Обновление — refresh_stories():
+  • сюжеты с dirty>0 (assign_pending добавил статьи) пересчитываются пакетно (features_batch);
+  • у активных сюжетов метрики влияния обновляются не чаще IMPACT_TTL_S (новые свечи ISS).
+"""
+import json, time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.core.config import HOTNESS_WEIGHTS
+from app.core.impact import cached_impact_metrics, prefetch_impacts, IMPACT_TTL_S
+from app.storage.db import get_db
+from app.nlp.embeddings import EMBED_TAG
+from app.nlp.matcher import Matches, stored_matches
+from app.nlp.topics import REL_MIN
+from app.scoring.hotness import (
+    EventColumns, features_batch, recency_score, velocity_score, norm_clip, logistic, IMPACT_SCALES
+)
+
+IMPACT_WINDOW_H = 6  # = min(6, hours) пайплайна для всех окон бота (6/24/48ч)
+ACTIVE_H = 48        # максимальное окно запроса: старым сюжетам влияние не обновляем
+TAIL = 12            # последних published_ts на сюжет — velocity насыщается на 6 статьях за 3ч
+STATIC = [k for k in HOTNESS_WEIGHTS if k not in ("recency", "velocity")]
+_CHUNK = 900
+
+
+def story_secids(m: Matches) -> List[str]:
+    # один проход матчера вместо extract_secids → company_secids → infer_targets
+    secids = m.secids or m.companies or m.targets
+    # last-resort: даже при низкой релевантности даём базовый прокси рынка
+    return secids or ["USDRUB_TOM"]
+
+def _z_static(F: Dict[str, float]) -> float:
+    return sum(HOTNESS_WEIGHTS[k]*F.get(k, 0.0) for k in STATIC)
+
+def _v_static(F: Dict[str, float]) -> float:
+    return 0.5*F["credibility"] + 0.3*F["confirmations"]
+
+def live_features(F: Dict[str, float], last_ts: int, tail: Optional[str], now: int) -> Dict[str, float]:
+    """Статические признаки + recency/velocity на момент now (в порядке HOTNESS_WEIGHTS)."""
+    dyn = {"recency": recency_score(last_ts, now), "velocity": velocity_score(json.loads(tail or "[]"), now)}
+    return {k: dyn[k] if k in dyn else F.get(k, 0.0) for k in HOTNESS_WEIGHTS}
+
+def _sql_hotness(z_static, last_ts, tail, now):
+    if z_static is None:
+        return None
+    z = (z_static + HOTNESS_WEIGHTS["recency"]*recency_score(last_ts, now)
+         + HOTNESS_WEIGHTS["velocity"]*velocity_score(json.loads(tail or "[]"), now))
+    return round(logistic(z/2.5), 3)
+
+def _sql_validity(v_static, last_ts, now):
+    if v_static is None:
+        return None
+    return round(v_static + 0.2*recency_score(last_ts, now), 3)
+
+def register_sql(conn):
+    conn.create_function("hotness", 4, _sql_hotness, deterministic=True)
+    conn.create_function("validity", 3, _sql_validity, deterministic=True)
+
+
+def _recompute(conn, stories, now):
+    """stories: [(id, dirty, pct_move, volume_ratio, price_anomaly)] → обновлённые строки."""
+    ids = [s[0] for s in stories]
+    arts: Dict[int, list] = {sid: [] for sid in ids}
+    for i in range(0, len(ids), _CHUNK):
+        part = ids[i:i+_CHUNK]
+        for r in conn.execute(f"""
+            SELECT m.story_id, a.source, a.title, a.summary, a.published_ts, a.cred_weight, a.source_group, a.entities
+            FROM story_members m JOIN articles a ON a.id=m.article_id
+            WHERE m.story_id IN ({','.join('?'*len(part))}) ORDER BY m.story_id, a.published_ts DESC
+            """, part):
+            arts[r[0]].append(r)
+    live = [s for s in stories if any(a[2] for a in arts[s[0]])]
+    out = [(0, None, None, None, None, None, None, s[1], s[0]) for s in stories if s not in live]  # всё в архиве
+    if not live:
+        return out
+    ms = [Matches.merge(stored_matches(a[7], (a[2] or "")+" "+(a[3] or "")) for a in arts[s[0]]) for s in live]
+    secids = [story_secids(m) for m in ms]
+    flat = [a for s in live for a in arts[s[0]]]
+    num = lambda x: np.nan if x is None else x
+    F = features_batch(EventColumns(
+        offsets=np.cumsum([0] + [len(arts[s[0]]) for s in live])[:-1],
+        ts=np.array([a[4] for a in flat], dtype=float),
+        cred=np.array([a[5] for a in flat], dtype=float),
+        group=np.array([a[6] or "" for a in flat]),
+        breadth=np.array([len(set(x)) for x in secids], dtype=float),
+        relevance=np.array([m.relevance for m in ms], dtype=float),
+        pct_move=np.array([num(s[2]) for s in live], dtype=float),
+        volume_ratio=np.array([num(s[3]) for s in live], dtype=float),
+        price_anomaly=np.array([num(s[4]) for s in live], dtype=float),
+    ), now)
+    for i, s in enumerate(live):
+        a = arts[s[0]]
+        groups = {x[6] for x in a}
+        official = bool(groups & {"REG", "EXCH"})
+        rel = ms[i].relevance
+        # те же фильтры, что раньше применялись к кластерам окна: шум и требование подтверждений
+        eligible = int((rel >= REL_MIN or official) and (len({x[1] for x in a}) >= 2 or official))
+        f = {k: float(F[k][i]) for k in STATIC}
+        tail = sorted((x[4] for x in a), reverse=True)[:TAIL]
+        out.append((eligible, _z_static(f), _v_static(f), json.dumps(tail), json.dumps(f),
+                    json.dumps(secids[i]), rel, s[1], s[0]))
+    return out
+
+def refresh_features(now: Optional[int] = None, batch: int = 500) -> int:
+    """Пересчитывает сюжеты, в которые добавились статьи. Возвращает число сюжетов."""
+    now = now or int(time.time())
+    done = 0
+    while True:
+        with get_db() as conn:
+            stories = conn.execute(
+                "SELECT id, dirty, pct_move, volume_ratio, price_anomaly FROM stories WHERE dirty>0 AND model=? LIMIT ?",
+                (EMBED_TAG, batch),
+            ).fetchall()
+            if not stories:
+                return done
+            # dirty — счётчик: если assign_pending успел добавить статью, пока мы считали, сюжет останется грязным
+            conn.executemany("""
+            UPDATE stories SET eligible=?, z_static=?, v_static=?, tail=?, features=?, secids=?, relevance=?,
+              dirty=MAX(0, dirty-?) WHERE id=?
+            """, _recompute(conn, stories, now))
+        done += len(stories)
+
+def refresh_impacts(now: Optional[int] = None) -> int:
+    """Метрики влияния активных сюжетов старше IMPACT_TTL_S: свечи качаются пакетно, с дедлайном."""
+    now = now or int(time.time())
+    with get_db() as conn:
+        rows = conn.execute("""
+        SELECT id, secids, features, pct_move, volume_ratio, price_anomaly FROM stories
+        WHERE model=? AND eligible=1 AND last_ts>=? AND (impact_ts IS NULL OR impact_ts<?)
+        """, (EMBED_TAG, now - ACTIVE_H*3600, now - IMPACT_TTL_S)).fetchall()
+    if not rows:
+        return 0
+    memo = {}
+    prefetch_impacts([(json.loads(r[1])[0], IMPACT_WINDOW_H) for r in rows], now, memo)
+    upd = []
+    for sid, secids, feats, *old in rows:
+        imp = cached_impact_metrics(json.loads(secids)[0], IMPACT_WINDOW_H, now, memo)
+        if all(x is None for x in imp):
+            imp = tuple(old)  # ISS не ответил к дедлайну — держим прошлые значения до следующего TTL
+        pct, vr, pa = imp
+        f = json.loads(feats)
+        f["price_move"]    = norm_clip(abs(pct) if pct is not None else None, *IMPACT_SCALES["price_move"])
+        f["volume_ratio"]  = norm_clip(vr, *IMPACT_SCALES["volume_ratio"])
+        f["price_anomaly"] = norm_clip(pa, *IMPACT_SCALES["price_anomaly"])
+        upd.append((pct, vr, pa, now, _z_static(f), json.dumps(f), sid))
+    with get_db() as conn:
+        conn.executemany("""
+        UPDATE stories SET pct_move=?, volume_ratio=?, price_anomaly=?, impact_ts=?, z_static=?, features=?
+        WHERE id=?
+        """, upd)
+    return len(upd)
+
+def refresh_stories(now: Optional[int] = None, impacts: bool = True):
+    """Вызывается ingestor'ом после индексации и пайплайном для «хвоста»; без изменений — пара запросов."""
+    now = now or int(time.time())
+    n = refresh_features(now)
+    return n, (refresh_impacts(now) if impacts else 0)
+
+def top_stories(since_ts: int, now: int, limit: int) -> List[tuple]:
+    """
+    Лучшие сюжеты окна одним запросом:
+    [(id, hotness, validity, features json, tail json, last_ts, secids json, pct_move, volume_ratio, price_anomaly)].
+    Не индексный top-k: сюжеты окна отбираются по idx_stories_eligible, затем hotness()/validity()
+    считаются для каждого и сортируются целиком.
+    """
+    with get_db() as conn:
+        register_sql(conn)
+        return conn.execute("""
+        SELECT id, hotness(z_static, last_ts, tail, ?) AS hot, validity(v_static, last_ts, ?) AS val,
+               features, tail, last_ts, secids, pct_move, volume_ratio, price_anomaly
+        FROM stories WHERE model=? AND eligible=1 AND last_ts>=?
+        ORDER BY hot DESC, val DESC LIMIT ?
+        """, (now, now, EMBED_TAG, since_ts, limit)).fetchall()
@@ -0,0 +1,39 @@
+from typing import List, Optional, Tuple
+from app.storage.db import get_db
+
+# ключ серии: (engine, market, secid, interval); бар: (begin 'YYYY-MM-DD HH:MM:SS', close, volume)
+Key = Tuple[str, str, str, int]
+Bar = Tuple[str, Optional[float], Optional[float]]
+
+def sync_state(key: Key) -> Tuple[Optional[str], int]:
+    """(begin последнего бара в кэше, время последней докачки)."""
+    with get_db() as conn:
+        last = conn.execute(
+            "SELECT MAX(begin) FROM candles WHERE engine=? AND market=? AND secid=? AND interval=?", key
+        ).fetchone()[0]
+        r = conn.execute(
+            "SELECT synced_ts FROM candle_sync WHERE engine=? AND market=? AND secid=? AND interval=?", key
+        ).fetchone()
+    return last, (r[0] if r else 0)
+
+def save_candles(key: Key, bars: List[Bar], synced_ts: int, keep_from: str):
+    # последний бар мог прийти неполным — REPLACE перезапишет его при следующей докачке
+    with get_db() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO candles(engine, market, secid, interval, begin, close, volume) VALUES(?,?,?,?,?,?,?)",
+            [(*key, b, c, v) for b, c, v in bars],
+        )
+        conn.execute(
+            "DELETE FROM candles WHERE engine=? AND market=? AND secid=? AND interval=? AND begin<?", (*key, keep_from)
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO candle_sync(engine, market, secid, interval, synced_ts) VALUES(?,?,?,?,?)",
+            (*key, synced_ts),
+        )
+
+def load_candles(key: Key, since: str) -> List[Bar]:
+    with get_db() as conn:
+        return conn.execute("""
+        SELECT begin, close, volume FROM candles
+        WHERE engine=? AND market=? AND secid=? AND interval=? AND begin>=? ORDER BY begin
+        """, (*key, since)).fetchall()
@@ -1,29 +1,193 @@
-import sqlite3, os, time
+import sqlite3, os, threading
 from contextlib import contextmanager
 
 DB_PATH = os.path.join(os.getcwd(), "data", "radar.db")
+ARCHIVE_PATH = os.path.join(os.getcwd(), "data", "radar_archive.db")  # холодный tier (app.storage.retention)
 
-SCHEMA = """
+# Настройки соединения: выставляются один раз на поток, а не на каждый запрос
+# auto_vacuum — до WAL: на новой БД действует сразу, на существующей — только после VACUUM
+# (разово: python -m app.storage.retention --vacuum)
+PRAGMAS = """
+PRAGMA auto_vacuum=INCREMENTAL;
 PRAGMA journal_mode=WAL;
-CREATE TABLE IF NOT EXISTS articles (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  source TEXT, url TEXT UNIQUE, title TEXT, published_ts INTEGER,
-  lang TEXT, summary TEXT, content TEXT, entities TEXT, secids TEXT,
-  source_group TEXT, cred_weight REAL, fetched_ts INTEGER
-);
+PRAGMA synchronous=NORMAL;
+PRAGMA busy_timeout=5000;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-65536;
+PRAGMA mmap_size=268435456;
 """
 
+# Версионированные миграции: i-я запись переводит БД с user_version=i на i+1.
+# Новые изменения схемы — только новой записью в конце, старые не редактируем.
+MIGRATIONS = [
+    # 1: базовая схема (IF NOT EXISTS — подхватывает БД, созданные до версионирования)
+    """
+    CREATE TABLE IF NOT EXISTS articles (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      source TEXT, url TEXT UNIQUE, title TEXT, published_ts INTEGER,
+      lang TEXT, summary TEXT, content TEXT, entities TEXT, secids TEXT,
+      source_group TEXT, cred_weight REAL, fetched_ts INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS feed_state (
+      source TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body_hash TEXT, checked_ts INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS embeddings (
+      article_id INTEGER PRIMARY KEY, model TEXT, dim INTEGER, vec BLOB
+    );
+    CREATE TABLE IF NOT EXISTS stories (
+      id INTEGER PRIMARY KEY AUTOINCREMENT, model TEXT, centroid BLOB,
+      n INTEGER, first_ts INTEGER, last_ts INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS idx_stories_last_ts ON stories(last_ts);
+    CREATE TABLE IF NOT EXISTS story_members (
+      article_id INTEGER PRIMARY KEY, story_id INTEGER, sim REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_story_members_story ON story_members(story_id);
+    CREATE TABLE IF NOT EXISTS candles (
+      engine TEXT, market TEXT, secid TEXT, interval INTEGER, begin TEXT, close REAL, volume REAL,
+      PRIMARY KEY(engine, market, secid, interval, begin)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS candle_sync (
+      engine TEXT, market TEXT, secid TEXT, interval INTEGER, synced_ts INTEGER,
+      PRIMARY KEY(engine, market, secid, interval)
+    );
+    """,
+    # 2: индексы под оконные запросы build_events и выборки по группе источников
+    """
+    CREATE INDEX IF NOT EXISTS idx_articles_published ON articles(published_ts);
+    CREATE INDEX IF NOT EXISTS idx_articles_group_published ON articles(source_group, published_ts);
+    CREATE INDEX IF NOT EXISTS idx_embeddings_model ON embeddings(model, article_id);
+    """,
+    # 3: сущности при сборе — релевантность в строке, обратный индекс secid → статьи
+    """
+    ALTER TABLE articles ADD COLUMN relevance REAL;
+    CREATE TABLE IF NOT EXISTS article_secids (
+      secid TEXT, published_ts INTEGER, article_id INTEGER,
+      PRIMARY KEY(secid, published_ts, article_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_articles_relevance_null ON articles(id) WHERE relevance IS NULL;
+    """,
+    # 4: материализованные признаки сюжетов (app.scoring.materialized); dirty — счётчик изменений
+    """
+    ALTER TABLE stories ADD COLUMN dirty INTEGER NOT NULL DEFAULT 1;
+    ALTER TABLE stories ADD COLUMN eligible INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE stories ADD COLUMN z_static REAL;
+    ALTER TABLE stories ADD COLUMN v_static REAL;
+    ALTER TABLE stories ADD COLUMN tail TEXT;
+    ALTER TABLE stories ADD COLUMN features TEXT;
+    ALTER TABLE stories ADD COLUMN secids TEXT;
+    ALTER TABLE stories ADD COLUMN relevance REAL;
+    ALTER TABLE stories ADD COLUMN pct_move REAL;
+    ALTER TABLE stories ADD COLUMN volume_ratio REAL;
+    ALTER TABLE stories ADD COLUMN price_anomaly REAL;
+    ALTER TABLE stories ADD COLUMN impact_ts INTEGER;
+    CREATE INDEX IF NOT EXISTS idx_stories_dirty ON stories(id) WHERE dirty>0;
+    CREATE INDEX IF NOT EXISTS idx_stories_eligible ON stories(model, eligible, last_ts);
+    """,
+    # 5: подписки бота и журнал отправленных алертов (дедуп по dedup_group, лимит в час)
+    """
+    CREATE TABLE IF NOT EXISTS subscriptions (
+      user_id INTEGER, kind TEXT, value TEXT, threshold REAL, created_ts INTEGER,
+      PRIMARY KEY(user_id, kind, value)
+    );
+    CREATE TABLE IF NOT EXISTS alerts_sent (
+      user_id INTEGER, dedup_group TEXT, hotness REAL, sent_ts INTEGER,
+      PRIMARY KEY(user_id, dedup_group)
+    );
+    CREATE INDEX IF NOT EXISTS idx_alerts_sent_user_ts ON alerts_sent(user_id, sent_ts);
+    """,
+    # 6: контрольная точка бэкфилла векторов (app.nlp.backfill): до какого id пройдено по модели
+    """
+    CREATE TABLE IF NOT EXISTS backfill_state (
+      model TEXT PRIMARY KEY, last_id INTEGER, done INTEGER, started_ts INTEGER, updated_ts INTEGER
+    );
+    """,
+    # 7: векторы — по (статья, модель): torch и onnx-int8 одной статьи больше не затирают друг друга
+    """
+    CREATE TABLE embeddings_v7 (
+      article_id INTEGER, model TEXT, dim INTEGER, vec BLOB, PRIMARY KEY(article_id, model)
+    );
+    INSERT INTO embeddings_v7(article_id, model, dim, vec) SELECT article_id, model, dim, vec FROM embeddings;
+    DROP TABLE embeddings;
+    ALTER TABLE embeddings_v7 RENAME TO embeddings;
+    CREATE INDEX idx_embeddings_model ON embeddings(model, article_id);
+    """,
+    # 8: строки обратного индекса secid, оставшиеся от статей, уже перенесённых в архив
+    """
+    DELETE FROM article_secids WHERE article_id NOT IN (SELECT id FROM articles);
+    """,
+    # 9: счётчик перезаписей вектора (0 — не перезаписывался): ANN-индекс обновляет такие строки на месте
+    """
+    ALTER TABLE embeddings ADD COLUMN seq INTEGER NOT NULL DEFAULT 0;
+    CREATE INDEX IF NOT EXISTS idx_embeddings_seq ON embeddings(model, seq, article_id);
+    """,
+]
+
+_local = threading.local()
+
+def _connect():
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.executescript(PRAGMAS)
+    return conn
+
+def connection():
+    """Одно соединение на поток (и на путь к БД — бенчмарки подменяют DB_PATH)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_PATH or _local.pid != os.getpid():
+        conn = _connect()
+        _local.conn, _local.path, _local.pid, _local.depth = conn, DB_PATH, os.getpid(), 0
+    return conn
+
 @contextmanager
 def get_db():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn = connection()
+    _local.depth += 1
     try:
         yield conn
-        conn.commit()
+        if _local.depth == 1:
+            conn.commit()
+    except BaseException:
+        if _local.depth == 1:
+            conn.rollback()
+        raise
     finally:
+        _local.depth -= 1
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS arc.articles_archive (
+  id INTEGER PRIMARY KEY,
+  source TEXT, url TEXT UNIQUE, title TEXT, published_ts INTEGER,
+  lang TEXT, summary_z BLOB, content_z BLOB, codec TEXT, entities TEXT, secids TEXT,
+  source_group TEXT, cred_weight REAL, fetched_ts INTEGER, archived_ts INTEGER
+);
+CREATE INDEX IF NOT EXISTS arc.idx_archive_published ON articles_archive(published_ts);
+"""
+
+def attach_archive(conn, create: bool = True) -> bool:
+    """Подключает архивную БД как схему arc. False — архива ещё нет, а create=False."""
+    if any(r[1] == "arc" for r in conn.execute("PRAGMA database_list")):
+        return True
+    if not create and not os.path.exists(ARCHIVE_PATH):
+        return False
+    os.makedirs(os.path.dirname(ARCHIVE_PATH), exist_ok=True)
+    conn.execute("ATTACH DATABASE ? AS arc", (ARCHIVE_PATH,))
+    conn.executescript(ARCHIVE_SCHEMA)
+    return True
+
+def close_db():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
         conn.close()
+        _local.conn = None
+
+def migrate(conn) -> int:
+    """Применяет недостающие миграции; возвращает итоговую версию схемы."""
+    ver = conn.execute("PRAGMA user_version").fetchone()[0]
+    for i in range(ver, len(MIGRATIONS)):
+        conn.executescript(f"BEGIN;\n{MIGRATIONS[i]}\nPRAGMA user_version={i + 1};\nCOMMIT;")
+    return len(MIGRATIONS)
 
 def init_db():
     with get_db() as conn:
-        conn.executescript(SCHEMA)
+        migrate(conn)
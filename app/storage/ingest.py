@@ -1,17 +1,134 @@
-from typing import List, Dict
-import time
-from app.storage.db import get_db
+from typing import List, Dict, Optional, Iterable, Set
+import time, json
+from app.storage.db import get_db, attach_archive
+from app.nlp.matcher import match_text
+
+_CHUNK = 900  # лимит параметров SQLite в IN (...)
+
+def _extract(title, summary):
+    """Сущности считаем один раз при сборе: (secids json, entities json, relevance)."""
+    m = match_text((title or "") + " " + (summary or ""))
+    return json.dumps(m.all_secids), json.dumps(m.to_json(), ensure_ascii=False), m.relevance
+
+def _index_secids(conn, rows):
+    # rows: (id, published_ts, secids json) → обратный индекс secid → статья
+    conn.executemany(
+        "INSERT OR IGNORE INTO article_secids(secid, published_ts, article_id) VALUES(?,?,?)",
+        [(sec, ts, aid) for aid, ts, js in rows for sec in json.loads(js or "[]")],
+    )
 
 def upsert_articles(items: List[Dict]) -> int:
+    """Пакетная вставка (одна транзакция, executemany). Возвращает число новых статей."""
+    if not items:
+        return 0
+    now = int(time.time())
+    rows = []
+    for it in items:
+        secids, entities, rel = _extract(it["title"], it.get("summary",""))
+        rows.append((
+          it["source"], it["url"], it["title"], it["published_ts"], it["lang"],
+          it.get("summary",""), it.get("content",""), entities, secids,
+          it.get("source_group","MEDIA"), it.get("cred_weight",0.5), now, rel
+        ))
+    with get_db() as conn:
+        cur = conn.executemany("""
+        INSERT OR IGNORE INTO articles(
+          source,url,title,published_ts,lang,summary,content,entities,secids,source_group,cred_weight,fetched_ts,relevance
+        ) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?)
+        """, rows)
+        added = max(cur.rowcount, 0)
+        if added:
+            urls = [r[1] for r in rows]
+            for i in range(0, len(urls), _CHUNK):
+                part = urls[i:i+_CHUNK]
+                _index_secids(conn, conn.execute(
+                    f"SELECT id, published_ts, secids FROM articles WHERE url IN ({','.join('?'*len(part))}) AND fetched_ts=?",
+                    (*part, now),
+                ).fetchall())
+        return added
+
+def extract_pending(batch: int = 1000) -> int:
+    """Досчитать сущности статьям, сохранённым до миграции 3 (relevance IS NULL)."""
+    done = 0
+    while True:
+        with get_db() as conn:
+            rows = conn.execute(
+                "SELECT id, title, summary, published_ts FROM articles WHERE relevance IS NULL LIMIT ?", (batch,)
+            ).fetchall()
+            if not rows:
+                return done
+            upd = [(*_extract(r[1], r[2]), r[0]) for r in rows]
+            conn.executemany("UPDATE articles SET secids=?, entities=?, relevance=? WHERE id=?", upd)
+            _index_secids(conn, [(r[0], r[3], u[0]) for r, u in zip(rows, upd)])
+        done += len(rows)
+
+def articles_by_secid(secid: str, since_ts: int, limit: int = 200) -> List[tuple]:
+    """Все новости по тикеру за окно — поиск по индексу, без сканирования текстов."""
+    with get_db() as conn:
+        return conn.execute("""
+        SELECT a.id, a.source, a.url, a.title, a.published_ts, a.source_group
+        FROM article_secids s JOIN articles a ON a.id=s.article_id
+        WHERE s.secid=? AND s.published_ts>=? ORDER BY s.published_ts DESC LIMIT ?
+        """, (secid.upper(), since_ts, limit)).fetchall()
+
+def articles_meta(ids: Iterable[int]) -> Dict[int, Dict]:
+    """{id: {source, url, title, published_ts}} — из горячей таблицы и из архива."""
+    ids = list(ids)
+    if not ids:
+        return {}
+    rows = []
+    with get_db() as conn:
+        arc = None
+        for i in range(0, len(ids), _CHUNK):
+            part = ids[i:i+_CHUNK]
+            q = ",".join("?"*len(part))
+            got = conn.execute(f"SELECT id, source, url, title, published_ts FROM articles WHERE id IN ({q})", part).fetchall()
+            if len(got) < len(part):
+                arc = attach_archive(conn, create=False) if arc is None else arc
+                if arc:
+                    got += conn.execute(
+                        f"SELECT id, source, url, title, published_ts FROM arc.articles_archive WHERE id IN ({q})", part
+                    ).fetchall()
+            rows += got
+    return {r[0]: {"source": r[1], "url": r[2], "title": r[3], "published_ts": r[4]} for r in rows}
+
+def known_urls(urls: Iterable[str]) -> Set[str]:
+    """Какие из URL уже лежат в articles (их незачем снова чистить trafilatura)."""
+    urls = [u for u in set(urls) if u]
+    if not urls:
+        return set()
+    rows = []
+    with get_db() as conn:
+        arc = None
+        for i in range(0, len(urls), _CHUNK):
+            part = urls[i:i+_CHUNK]
+            marks = ','.join('?'*len(part))
+            got = conn.execute(f"SELECT url FROM main.articles WHERE url IN ({marks})", part).fetchall()
+            # старые записи ленты могли уже уехать в архив — их тоже не тащим обратно
+            if len(got) < len(part):
+                arc = attach_archive(conn, create=False) if arc is None else arc
+                if arc:
+                    got += conn.execute(f"SELECT url FROM arc.articles_archive WHERE url IN ({marks})", part).fetchall()
+            rows += got
+    return {r[0] for r in rows}
+
+def get_feed_state(source: str) -> Optional[Dict]:
+    with get_db() as conn:
+        r = conn.execute(
+            "SELECT etag, last_modified, body_hash FROM feed_state WHERE source=?", (source,)
+        ).fetchone()
+    return {"etag": r[0], "last_modified": r[1], "body_hash": r[2]} if r else None
+
+def save_feed_state(source: str, etag: Optional[str], last_modified: Optional[str], body_hash: Optional[str]):
+    with get_db() as conn:
+        conn.execute("""
+        INSERT INTO feed_state(source, etag, last_modified, body_hash, checked_ts) VALUES(?,?,?,?,?)
+        ON CONFLICT(source) DO UPDATE SET
+          etag=excluded.etag, last_modified=excluded.last_modified,
+          body_hash=excluded.body_hash, checked_ts=excluded.checked_ts
+        """, (source, etag, last_modified, body_hash, int(time.time())))
+
+def articles_version() -> int:
+    """Растёт при каждой новой статье (MAX по PK — O(1)); ключ инвалидации кэшей."""
     with get_db() as conn:
-        for it in items:
-            conn.execute("""
-            INSERT OR IGNORE INTO articles(
-              source,url,title,published_ts,lang,summary,content,entities,secids,source_group,cred_weight,fetched_ts
-            ) VALUES(?,?,?,?,?,?,?,?,?,?,?,?)
-            """, (
-              it["source"], it["url"], it["title"], it["published_ts"], it["lang"],
-              it.get("summary",""), it.get("content",""), "[]","[]",
-              it.get("source_group","MEDIA"), it.get("cred_weight",0.5), int(time.time())
-            ))
-        return conn.total_changes or 0
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM articles").fetchone()[0]
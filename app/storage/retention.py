@@ -0,0 +1,108 @@
+"""
+Горячее окно и архив.
+
+Статьи старше HOT_HOURS переезжают из articles в data/radar_archive.db
+(summary/content сжаты zstd, без zstandard — zlib). Векторы и членство
+в сюжетах остаются в основной БД: они компактны и нужны для поиска по истории.
+После переноса — checkpoint WAL и incremental vacuum, чтобы горячая БД
+оставалась маленькой и помещалась в page cache.
+
+Запуск вручную/по cron:  python -m app.storage.retention
+Разово для БД, созданной до auto_vacuum=INCREMENTAL (новые создаются сразу с ним), при
+остановленных боте и ingestor'е:  python -m app.storage.retention --vacuum
+(полный VACUUM переписывает файл и держит блокировку записи всё это время — не из фоновой задачи).
+"""
+import sys, json, time, zlib, logging
+from typing import Optional
+
+from app.core.config import HOT_HOURS, VACUUM_PAGES
+from app.storage.db import get_db, attach_archive
+
+try:
+    import zstandard as zstd
+    _zc, _zd = zstd.ZstdCompressor(level=9), zstd.ZstdDecompressor()
+    CODEC = "zstd"
+except ImportError:  # без zstandard — тот же формат хранения, просто zlib
+    zstd = None
+    CODEC = "zlib"
+
+log = logging.getLogger("radar.retention")
+
+def pack(text: Optional[str]) -> Optional[bytes]:
+    if not text:
+        return None
+    raw = text.encode("utf-8")
+    return _zc.compress(raw) if CODEC == "zstd" else zlib.compress(raw, 9)
+
+def unpack(blob: Optional[bytes], codec: str) -> str:
+    if not blob:
+        return ""
+    if codec == "zstd":
+        if zstd is None:
+            raise RuntimeError("архив сжат zstd: pip install zstandard")
+        return _zd.decompress(blob).decode("utf-8")
+    return zlib.decompress(blob).decode("utf-8")
+
+def archive_old(hot_hours: int = HOT_HOURS, batch: int = 2000) -> int:
+    """Переносит статьи старше hot_hours в архив. Возвращает число перенесённых."""
+    cutoff = int(time.time()) - hot_hours*3600
+    moved = 0
+    while True:
+        with get_db() as conn:
+            attach_archive(conn)
+            rows = conn.execute("""
+            SELECT id, source, url, title, published_ts, lang, summary, content, entities, secids,
+                   source_group, cred_weight, fetched_ts
+            FROM main.articles WHERE published_ts<? ORDER BY published_ts LIMIT ?
+            """, (cutoff, batch)).fetchall()
+            if not rows:
+                return moved
+            now = int(time.time())
+            # сначала пишем в архив, потом удаляем: при сбое — дубль, но не потеря
+            conn.executemany("""
+            INSERT OR IGNORE INTO arc.articles_archive(
+              id, source, url, title, published_ts, lang, summary_z, content_z, codec, entities, secids,
+              source_group, cred_weight, fetched_ts, archived_ts
+            ) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+            """, [(r[0], r[1], r[2], r[3], r[4], r[5], pack(r[6]), pack(r[7]), CODEC, r[8], r[9],
+                   r[10], r[11], r[12], now) for r in rows])
+            conn.executemany("DELETE FROM main.articles WHERE id=?", [(r[0],) for r in rows])
+            # обратный индекс secid → статья только по горячей таблице: строки уехавших статей — туда же
+            conn.executemany("DELETE FROM article_secids WHERE secid=? AND published_ts=? AND article_id=?",
+                             [(sec, r[4], r[0]) for r in rows for sec in json.loads(r[9] or "[]")])
+        moved += len(rows)
+
+def enable_incremental_vacuum():
+    """Разовый перевод старой БД в auto_vacuum=INCREMENTAL: полный VACUUM, только офлайн (--vacuum)."""
+    with get_db() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.commit()
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+
+def compact(pages: int = VACUUM_PAGES):
+    """Checkpoint WAL + возврат свободных страниц (incremental vacuum). Полного VACUUM здесь нет."""
+    with get_db() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+        else:
+            log.warning("auto_vacuum выключен — файл БД не сжимается; один раз: python -m app.storage.retention --vacuum")
+        conn.commit()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+def run_retention() -> int:
+    moved = archive_old()
+    compact()
+    if moved:
+        log.info("retention: %d статей в архив", moved)
+    return moved
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from app.storage.db import init_db
+    init_db()
+    if "--vacuum" in sys.argv[1:]:
+        print("auto_vacuum=INCREMENTAL" if enable_incremental_vacuum() else "уже INCREMENTAL")
+    print(run_retention())
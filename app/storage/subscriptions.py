@@ -0,0 +1,64 @@
+import time
+from typing import Dict, Iterable, List, Set, Tuple
+from app.storage.db import get_db
+
+_CHUNK = 900  # лимит параметров SQLite в IN (...)
+
+# kind: "ticker" — value=SECID; "hot" — value="*", любой сюжет выше порога
+def subscribe(user_id: int, kind: str, value: str, threshold: float):
+    with get_db() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO subscriptions(user_id, kind, value, threshold, created_ts) VALUES(?,?,?,?,?)",
+            (user_id, kind, value, threshold, int(time.time())),
+        )
+
+def unsubscribe(user_id: int, kind: str = None, value: str = None) -> int:
+    """Без kind — все подписки пользователя. Возвращает число удалённых."""
+    with get_db() as conn:
+        if kind is None:
+            cur = conn.execute("DELETE FROM subscriptions WHERE user_id=?", (user_id,))
+        else:
+            cur = conn.execute("DELETE FROM subscriptions WHERE user_id=? AND kind=? AND value=?", (user_id, kind, value))
+        return cur.rowcount
+
+def user_subscriptions(user_id: int) -> List[Tuple[str, str, float]]:
+    with get_db() as conn:
+        return conn.execute(
+            "SELECT kind, value, threshold FROM subscriptions WHERE user_id=? ORDER BY kind, value", (user_id,)
+        ).fetchall()
+
+def all_subscriptions() -> List[Tuple[int, str, str, float]]:
+    with get_db() as conn:
+        return conn.execute("SELECT user_id, kind, value, threshold FROM subscriptions").fetchall()
+
+def sent_groups(user_ids: Iterable[int], groups: Iterable[str]) -> Set[Tuple[int, str]]:
+    """Какие (user_id, dedup_group) уже отправлялись."""
+    users, groups = list(set(user_ids)), list(set(groups))
+    if not users or not groups:
+        return set()
+    out: Set[Tuple[int, str]] = set()
+    half = _CHUNK // 2  # два IN в одном запросе — на каждый половина лимита
+    with get_db() as conn:
+        for i in range(0, len(users), half):
+            us = users[i:i+half]
+            for j in range(0, len(groups), half):
+                gs = groups[j:j+half]
+                out.update(conn.execute(
+                    f"SELECT user_id, dedup_group FROM alerts_sent WHERE user_id IN ({','.join('?'*len(us))}) "
+                    f"AND dedup_group IN ({','.join('?'*len(gs))})", (*us, *gs),
+                ).fetchall())
+    return out
+
+def sent_counts(since_ts: int) -> Dict[int, int]:
+    """{user_id: число алертов с since_ts} — для лимита частоты."""
+    with get_db() as conn:
+        return dict(conn.execute(
+            "SELECT user_id, COUNT(*) FROM alerts_sent WHERE sent_ts>=? GROUP BY user_id", (since_ts,)
+        ).fetchall())
+
+def mark_sent(user_id: int, dedup_group: str, hotness: float):
+    with get_db() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO alerts_sent(user_id, dedup_group, hotness, sent_ts) VALUES(?,?,?,?)",
+            (user_id, dedup_group, hotness, int(time.time())),
+        )
@@ -0,0 +1,52 @@
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+from app.storage.db import get_db
+
+VEC_DTYPE = np.float16  # нормированные e5-векторы: половина места, точности косинуса хватает
+_CHUNK = 900            # лимит параметров SQLite в IN (...)
+
+def load_vectors(ids: Iterable[int], model: str) -> Dict[int, np.ndarray]:
+    """{article_id: float32-вектор} для тех id, у кого есть вектор именно этой модели."""
+    ids = list(ids); out: Dict[int, np.ndarray] = {}
+    with get_db() as conn:
+        for i in range(0, len(ids), _CHUNK):
+            part = ids[i:i+_CHUNK]
+            for aid, blob in conn.execute(
+                f"SELECT article_id, vec FROM embeddings WHERE model=? AND article_id IN ({','.join('?'*len(part))})",
+                (model, *part),
+            ):
+                out[aid] = np.frombuffer(blob, dtype=VEC_DTYPE).astype(np.float32)
+    return out
+
+def save_vectors(ids: List[int], mat: np.ndarray, model: str):
+    """
+    Новый вектор пишется с seq=0; перезапись уже сохранённого получает следующий seq модели —
+    по нему ANN-индекс (app.nlp.ann) находит строки, которые нужно обновить на месте.
+    """
+    mat = np.asarray(mat, dtype=VEC_DTYPE)
+    with get_db() as conn:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")  # seq читаем и пишем под одной блокировкой записи
+        seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM embeddings WHERE model=?", (model,)).fetchone()[0]
+        conn.executemany(
+            "INSERT INTO embeddings(article_id, model, dim, vec, seq) VALUES(?,?,?,?,0) "
+            "ON CONFLICT(article_id, model) DO UPDATE SET dim=excluded.dim, vec=excluded.vec, seq=?",
+            [(int(aid), model, int(v.shape[0]), v.tobytes(), seq) for aid, v in zip(ids, mat)],
+        )
+
+def rewritten_since(model: str, seq: int) -> Tuple[List[int], int]:
+    """(id статей, чьи векторы модели перезаписаны после seq, текущий максимальный seq)."""
+    with get_db() as conn:
+        ids = [r[0] for r in conn.execute(
+            "SELECT article_id FROM embeddings WHERE model=? AND seq>? ORDER BY seq", (model, seq))]
+        top = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM embeddings WHERE model=?", (model,)).fetchone()[0]
+    return ids, top
+
+def pending_articles(model: str, limit: int = 256) -> List[Tuple[int, str, str]]:
+    """Статьи без вектора текущей модели (новые или посчитанные старой моделью)."""
+    with get_db() as conn:
+        return conn.execute("""
+        SELECT a.id, a.title, a.summary FROM articles a
+        LEFT JOIN embeddings e ON e.article_id=a.id AND e.model=?
+        WHERE e.article_id IS NULL ORDER BY a.id LIMIT ?
+        """, (model, limit)).fetchall()
@@ -1,4 +1,4 @@
-import os, sys, time
+import os, sys, time, asyncio, threading
 import streamlit as st
 
 ROOT=os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
@@ -7,43 +7,92 @@ if ROOT not in sys.path: sys.path.insert(0, ROOT)
 from dotenv import load_dotenv, find_dotenv
 load_dotenv(find_dotenv())
 
-from app.core.pipeline import build_events
+from app.core.config import WEB_REFRESH_S, WEB_PAGE_SIZE, INGEST_IN_WEB
+from app.storage.db import init_db
+from app.web.view import StoryView
+from app.scoring.materialized import IMPACT_WINDOW_H, ACTIVE_H
+
+@st.cache_resource
+def boot():
+    # один раз на процесс, а не на сессию/перезапуск скрипта
+    init_db()
+    if INGEST_IN_WEB:
+        from app.core.ingestor import Ingestor
+        threading.Thread(target=lambda: asyncio.run(Ingestor().run_async()), daemon=True, name="radar-ingest").start()
+    return True
+
+@st.cache_resource
+def view(hours:int) -> StoryView:
+    # общая для всех зрителей: карточки между обновлениями переиспользуются
+    return StoryView(hours)
+
+@st.cache_data(ttl=WEB_REFRESH_S, show_spinner=False)
+def refreshed(hours:int):
+    """Раз в WEB_REFRESH_S на процесс: дельта-обновление выдачи. (время, всего карточек, перечитано)."""
+    v=view(hours)
+    v.refresh()
+    return v.refreshed_ts, len(v.events), v.last_changed
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def page(hours:int, n:int, size:int, ts:int):
+    # ts в ключе: страница кэшируется до следующего обновления выдачи
+    return view(hours).page(n, size)
+
+def card(ev, new):
+    with st.container(border=True):
+        st.subheader(f"{'🆕 ' if new else ''}🔥 {ev['headline']} — hotness {ev['hotness']} (валидн. {ev['validity']:.2f})")
+        c1,c2=st.columns([2,1])
+        with c1:
+            st.markdown(f"**Почему сейчас:** {ev['why_now']}")
+            st.markdown("**Ссылки:**")
+            for s in ev["sources"]:
+                st.markdown(f"- [{s['source']}]({s['url']})")
+            st.markdown("**Черновик (для канала):**")
+            t0=time.strftime('%d.%m %H:%M', time.localtime(ev['timeline'][0]['t']))
+            st.code(f"[{ev['secids'][0] if ev['secids'] else '—'}] {ev['headline']} | "
+                    f"Δ {ev['impact']['pct_move'] if ev['impact']['pct_move'] is not None else 'n/a'}%, "
+                    f"vol {ev['impact']['volume_ratio'] if ev['impact']['volume_ratio'] is not None else 'n/a'}x, "
+                    f"σ {ev['impact']['price_anomaly'] if ev['impact']['price_anomaly'] is not None else 'n/a'} | "
+                    f"hotness {ev['hotness']} | валидн. {ev['validity']:.2f} | с {t0}")
+        with c2:
+            t0=time.strftime('%d.%m %H:%M', time.localtime(ev['timeline'][0]['t']))
+            t1=time.strftime('%d.%m %H:%M', time.localtime(ev['timeline'][-1]['t']))
+            st.markdown(f"**Таймлайн:** {t0} → {t1}")
+            st.markdown(f"**Тикеры:** {', '.join(ev['secids'] or ['—'])}")
+            imp=ev["impact"]
+            st.metric("Δ%", f"{(imp['pct_move'] or 0):+.2f}%")
+            st.metric("Объём", f"{(imp['volume_ratio'] or 0):.2f}x")
+            st.metric("Аномалия", f"{(imp['price_anomaly'] or 0):.1f}σ")
 
 st.set_page_config(page_title="RADAR — горячие события", layout="wide")
 st.title("RADAR — горячие события")
+boot()
+
+# влияние у сюжетов материализовано за IMPACT_WINDOW_H и обновляется только в пределах ACTIVE_H:
+# в более узком окне Δ% был бы не за окно, в более широком — устаревший
+hours = st.sidebar.number_input("Окно, часов", IMPACT_WINDOW_H, ACTIVE_H, 24,
+                                help=f"Δ%, объём и аномалия — за {IMPACT_WINDOW_H}ч после публикаций")
+size = st.sidebar.number_input("Карточек на странице", 1, 50, WEB_PAGE_SIZE)
+auto = st.sidebar.toggle("Автообновление", True, help=f"раз в {WEB_REFRESH_S} с, только изменившиеся сюжеты")
+if st.sidebar.button("Обновить"):
+    refreshed.clear()
+
+@st.fragment(run_every=WEB_REFRESH_S if auto else None)
+def cards():
+    ts, total, changed = refreshed(hours)
+    if not total:
+        st.info("В окне пока нет сюжетов. Сбор идёт в фоне (бот или python -m app.core.ingestor).")
+        return
+    pages = -(-total // size)
+    n = st.number_input(f"Страница (из {pages})", 1, pages, 1) - 1
+    st.caption(f"Сюжетов в окне: {total} · обновлено {time.strftime('%H:%M:%S', time.localtime(ts))}, "
+               f"перечитано сюжетов: {changed}")
+    # «новое» — публикации после предыдущего обновления, которое видела эта сессия
+    ss = st.session_state
+    if ss.get("ts") != ts:
+        ss["prev"], ss["ts"] = ss.get("ts"), ts
+    prev = ss.get("prev")
+    for ev in page(hours, n, size, ts):
+        card(ev, prev is not None and ev["t1"] > prev)
 
-hours = st.sidebar.number_input("Окно, часов", 1, 72, 24)
-k = st.sidebar.number_input("Top-K", 1, 20, 7)
-
-if st.button("Обновить"):
-    st.session_state["events"]=build_events(hours,k)
-
-evs=st.session_state.get("events", [])
-if not evs:
-    st.info("Нажмите «Обновить».")
-else:
-    for ev in evs:
-        with st.container(border=True):
-            st.subheader(f"🔥 {ev['headline']} — hotness {ev['hotness']} (валидн. {ev['validity']:.2f})")
-            c1,c2=st.columns([2,1])
-            with c1:
-                st.markdown(f"**Почему сейчас:** {ev['why_now']}")
-                st.markdown("**Ссылки:**")
-                for s in ev["sources"]:
-                    st.markdown(f"- [{s['source']}]({s['url']})")
-                st.markdown("**Черновик (для канала):**")
-                t0=time.strftime('%d.%m %H:%M', time.localtime(ev['timeline'][0]['t']))
-                st.code(f"[{ev['secids'][0] if ev['secids'] else '—'}] {ev['headline']} | "
-                        f"Δ {ev['impact']['pct_move'] if ev['impact']['pct_move'] is not None else 'n/a'}%, "
-                        f"vol {ev['impact']['volume_ratio'] if ev['impact']['volume_ratio'] is not None else 'n/a'}x, "
-                        f"σ {ev['impact']['price_anomaly'] if ev['impact']['price_anomaly'] is not None else 'n/a'} | "
-                        f"hotness {ev['hotness']} | валидн. {ev['validity']:.2f} | с {t0}")
-            with c2:
-                t0=time.strftime('%d.%m %H:%M', time.localtime(ev['timeline'][0]['t']))
-                t1=time.strftime('%d.%m %H:%M', time.localtime(ev['timeline'][-1]['t']))
-                st.markdown(f"**Таймлайн:** {t0} → {t1}")
-                st.markdown(f"**Тикеры:** {', '.join(ev['secids'] or ['—'])}")
-                imp=ev["impact"]
-                st.metric("Δ%", f"{(imp['pct_move'] or 0):+.2f}%")
-                st.metric("Объём", f"{(imp['volume_ratio'] or 0):.2f}x")
-                st.metric("Аномалия", f"{(imp['price_anomaly'] or 0):.1f}σ")
+cards()
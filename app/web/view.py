@@ -0,0 +1,73 @@
+"""
+Общая для всех зрителей дашборда выдача по сохранённым сюжетам, обновляемая дельтами.
+
+StoryView держит карточки сюжетов окна. refresh() — один запрос top_stories
+(hotness/validity на момент now считает SQLite) плюс перечитывание статей только у сюжетов,
+которые изменились с прошлого раза: добавились статьи (stories.n), обновились метрики
+влияния (impact_ts) или старые публикации ушли за край окна. У остальных карточек
+обновляются только hotness/validity/признаки. Сбор, векторы и сюжеты — дело ingestor'а.
+"""
+import json, time, threading
+from typing import Dict, List, Optional
+
+from app.storage.db import get_db
+from app.scoring.materialized import top_stories, live_features
+from app.core.pipeline import story_events
+
+VIEW_MAX = 500  # сюжетов окна в выдаче (страницы режутся из неё)
+_CHUNK = 900
+
+
+def _versions(ids) -> Dict[int, tuple]:
+    out = {}
+    with get_db() as conn:
+        for i in range(0, len(ids), _CHUNK):
+            part = ids[i:i+_CHUNK]
+            for sid, n, impact_ts in conn.execute(
+                f"SELECT id, n, impact_ts FROM stories WHERE id IN ({','.join('?'*len(part))})", part
+            ):
+                out[sid] = (n, impact_ts)
+    return out
+
+
+class StoryView:
+    def __init__(self, hours: int, limit: int = VIEW_MAX):
+        self.hours = hours
+        self.limit = limit
+        self.cards: Dict[int, dict] = {}    # story id -> карточка (как у build_events)
+        self.versions: Dict[int, tuple] = {}
+        self.events: List[dict] = []        # текущий порядок выдачи
+        self.refreshed_ts = 0
+        self.last_changed = 0
+        self._lock = threading.Lock()       # сессии Streamlit — разные потоки
+
+    def refresh(self, now: Optional[int] = None) -> List[dict]:
+        now = now or int(time.time())
+        with self._lock:
+            since = now - self.hours*3600
+            top = top_stories(since, now, self.limit)
+            ver = _versions([t[0] for t in top])
+            stale = [t for t in top
+                     if t[0] not in self.cards or self.versions.get(t[0]) != ver.get(t[0])
+                     or (self.cards[t[0]] is not None and self.cards[t[0]]["t0"] < since)]
+            # статьи перечитываем только у изменившихся сюжетов
+            fresh = {int(ev["dedup_group"][1:]): ev for ev in story_events(stale, since, now)}
+            for t in stale:
+                self.cards[t[0]] = fresh.get(t[0])  # None — все статьи сюжета вне окна
+                self.versions[t[0]] = ver.get(t[0])
+            events = []
+            for sid, hot, val, feats, tail, last_ts, *_ in top:
+                ev = self.cards.get(sid)
+                if ev is None:
+                    continue
+                ev["hotness"], ev["validity"] = hot, val
+                ev["features"] = live_features(json.loads(feats), last_ts, tail, now)
+                events.append(ev)
+            keep = {t[0] for t in top}
+            for sid in [s for s in self.cards if s not in keep]:
+                self.cards.pop(sid); self.versions.pop(sid, None)
+            self.events, self.refreshed_ts, self.last_changed = events, now, len(stale)
+            return events
+
+    def page(self, n: int, size: int) -> List[dict]:
+        return self.events[n*size:(n+1)*size]